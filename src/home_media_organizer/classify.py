@@ -1,94 +1,188 @@
 import argparse
 import logging
+import os
+from functools import lru_cache
+from importlib.metadata import PackageNotFoundError, version
 from multiprocessing import Pool
 from pathlib import Path
-from typing import Any, Dict, Generic, List, Tuple, Type, TypeVar, cast
+from typing import Any, Dict, Generator, Generic, Iterable, List, Tuple, Type, TypeVar, cast
 
 import numpy as np
 from tqdm import tqdm  # type: ignore
 
 from .home_media_organizer import iter_files
 from .media_file import MediaFile
-from .utils import cache
+from .utils import cache, calculate_file_hash, get_file_hash, manifest
+
+T = TypeVar("T")
+
+# classifiers of the current process, which are created by init_classifiers once per
+# worker process instead of once per file
+classifiers: List["Classifier"] = []
+# models loaded by the current process, keyed by fullname of classifiers
+loaded_models: Dict[str, Any] = {}
+# results of DeepFace.analyze for images of the current batch, keyed by filename and backend
+analyzed_faces: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+# content signatures of images of the current batch
+batch_signatures: Dict[Path, str] = {}
+
+
+def init_classifiers(
+    models: Tuple[str, ...],
+    threshold: float | None,
+    top_k: int | None,
+    tags: Tuple[str] | None,
+    suffix: str | None,
+    logger: logging.Logger | None,
+) -> None:
+    global classifiers
+    classifiers = [
+        get_classifier_class(x)(x, threshold, top_k, tags, suffix, logger) for x in models
+    ]
 
 
 #
 # tag medias with results from a classifier
 #
-def classify_image(
-    params: Tuple[
-        Path,
-        Tuple[str],
-        float | None,
-        int | None,
-        Tuple[str] | None,
-        str | None,
-        logging.Logger | None,
-    ]
-) -> Tuple[Path, Dict[str, Any]]:
-    filename, models, threshold, top_k, tags, suffix, logger = params
-    res: Dict[str, Any] = {}
+def classify_images(
+    items: List[Tuple[Path, str | None]],
+) -> List[Tuple[Path, Dict[str, Any]]]:
+    """Classify images with all classifiers, given their names and content signatures."""
+    fullnames = [x for x, _ in items]
+    batch_signatures.update({x: signature for x, signature in items if signature is not None})
+    res: List[Dict[str, Any]] = [{} for _ in fullnames]
+    try:
+        for model in classifiers:
+            for tags, model_tags in zip(res, model.classify_batch(fullnames)):
+                tags |= model_tags
+    finally:
+        analyzed_faces.clear()
+        batch_signatures.clear()
+
+    return list(zip(fullnames, res))
+
+
+def get_signature(filename: Path) -> Tuple[Path, str | None, os.stat_result | None]:
+    """Return the signature of a file, and its stat if the signature should be saved."""
     fullname = filename.resolve()
-    for model_name in models:
-        model_class: Type[Classifier] = get_classifier_class(model_name)
-        model = model_class(model_name, threshold, top_k, tags, suffix, logger)
-        res |= model.classify(fullname)
+    try:
+        stat = fullname.stat()
+        signature = manifest.get_signature(stat)
+        if signature is not None:
+            return fullname, signature, None
+        return fullname, calculate_file_hash(fullname), stat
+    except OSError:
+        return fullname, None, None
+
+
+def group_by_content(
+    items: Iterable[Tuple[Path, str | None, os.stat_result | None]],
+) -> List[Tuple[List[Path], str | None]]:
+    """Group files with the same content, so that each group is classified only once."""
+    groups: Dict[str, List[Path]] = {}
+    ungrouped: List[Tuple[List[Path], str | None]] = []
+    for fullname, signature, stat in items:
+        if signature is None:
+            ungrouped.append(([fullname], None))
+            continue
+        if stat is not None:
+            manifest.set_signature(stat, signature)
+        groups.setdefault(signature, []).append(fullname)
+    return [(files, signature) for signature, files in groups.items()] + ungrouped
+
+
+def tag_files(
+    filenames: List[Path],
+    tags: Dict[str, Any],
+    args: argparse.Namespace,
+    logger: logging.Logger | None,
+) -> None:
+    if args.confirmed is not True:
+        for filename in filenames:
+            MediaFile(filename).set_tags(tags, args.overwrite, args.confirmed, logger)
+        return
+    # tag all copies of the same content with one write to the manifest
+    if args.overwrite:
+        manifest.set_tags_many([(x, tags) for x in filenames])
+    else:
+        manifest.add_tags_many([(x, tags) for x in filenames])
+    if logger is not None:
+        for filename in filenames:
+            logger.info(
+                f"""Tags [magenta]{", ".join(tags.keys())}[/magenta] added to [blue]{filename}[/blue]"""
+            )
+
+
+@lru_cache
+def get_package_version(package: str) -> str:
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return ""
 
-    return fullname, res
+
+def chunked(items: Iterable[T], size: int) -> Generator[List[T], None, None]:
+    chunk: List[T] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 def classify(args: argparse.Namespace, logger: logging.Logger | None) -> None:
     cnt = 0
     processed_cnt = 0
 
+    initargs = (
+        tuple(args.models),
+        args.threshold,
+        args.top_k,
+        (tuple(args.tags) if args.tags is not None else args.tags),
+        args.suffix,
+        logger,
+    )
     # download the model if needed
     if args.confirmed is not None:
-        with Pool(args.jobs or None) as pool:
-            for item, tags in tqdm(
-                pool.imap(
-                    classify_image,
-                    {
-                        (
-                            x,
-                            tuple(args.models),
-                            args.threshold,
-                            args.top_k,
-                            (tuple(args.tags) if args.tags is not None else args.tags),
-                            args.suffix,
-                            logger,
-                        )
-                        for x in iter_files(args)
-                    },
-                ),
-                desc="Classifying media",
-            ):
+        pool = Pool(args.jobs or None, initializer=init_classifiers, initargs=initargs)
+        with pool, manifest.batch():
+            groups = group_by_content(
+                tqdm(
+                    pool.imap(get_signature, set(iter_files(args)), chunksize=16),
+                    desc="Checking file content",
+                )
+            )
+            copies = {files[0]: files for files, _ in groups}
+            # classify the first file of each group
+            chunks = chunked(
+                ((files[0], signature) for files, signature in groups), args.batch_size
+            )
+            results = (x for res in pool.imap(classify_images, chunks) for x in res)
+            for item, tags in tqdm(results, desc="Classifying media", total=len(groups)):
+                processed_cnt += len(copies[item])
                 if not tags:
                     continue
                 if logger:
-                    logger.debug(f"Tagging {item} with {tags}")
-                MediaFile(item).set_tags(tags, args.overwrite, args.confirmed, logger)
-
-                processed_cnt += 1
-                if tags:
-                    cnt += 1
+                    logger.debug(f"Tagging {copies[item]} with {tags}")
+                tag_files(copies[item], tags, args, logger)
+                cnt += len(copies[item])
     else:
         # interactive mode
-        for item in iter_files(args, logger=logger):
-            tags = classify_image(
-                (
-                    item,
-                    tuple(args.models),
-                    args.threshold,
-                    args.top_k,
-                    (tuple(args.tags) if args.tags is not None else args.tags),
-                    args.suffix,
-                    logger,
-                )
-            )[1]
-            if tags:
-                MediaFile(item).set_tags(tags, args.overwrite, args.confirmed, logger)
-                cnt += 1
-            processed_cnt += 1
+        init_classifiers(*initargs)
+        with manifest.batch():
+            groups = group_by_content(map(get_signature, iter_files(args, logger=logger)))
+            copies = {files[0]: files for files, _ in groups}
+            chunks = chunked(
+                ((files[0], signature) for files, signature in groups), args.batch_size
+            )
+            for chunk in chunks:
+                for item, tags in classify_images(chunk):
+                    if tags:
+                        tag_files(copies[item], tags, args, logger)
+                        cnt += len(copies[item])
+                    processed_cnt += len(copies[item])
     if logger is not None:
         logger.info(f"[blue]{cnt}[/blue] of {processed_cnt} files are tagged.")
 
@@ -127,6 +221,8 @@ class Classifier(Generic[TClassifier]):
     default_option = ""
     allowed_options: Tuple[str, ...] = ()
     labels: Tuple[str, ...] = ()
+    # package of the model, the version of which is part of the keys of cached results
+    package = ""
 
     def __init__(
         self,
@@ -152,7 +248,7 @@ class Classifier(Generic[TClassifier]):
             raise ValueError(
                 f"""{self.feature} does not support model {self.model_name}. Please choose from {", ".join(self.allowed_models)}"""
             )
-        if self.model_option not in self.allowed_options:
+        if self.model_option not in (self.default_option, *self.allowed_options):
             raise ValueError(
                 f"""{self.feature} does not support model option {self.model_name}. Please choose from {", ".join(self.allowed_options)}"""
             )
@@ -162,35 +258,82 @@ class Classifier(Generic[TClassifier]):
         #     if tag not in self.labels:
         #         raise ValueError(f"{self.feature} does not support tag: {tag}")
 
-    def _cache_key(self, filename: Path) -> Tuple[str, str, str, str]:
+    @property
+    def model(self) -> Any:
+        """Model of the classifier, which is loaded once per process."""
+        if self.fullname not in loaded_models:
+            loaded_models[self.fullname] = self._load_model()
+        return loaded_models[self.fullname]
+
+    def _load_model(self) -> Any:
+        return None
+
+    def _cache_key(self, filename: Path) -> Tuple[str, ...]:
+        """Key of cached results by the content of the file instead of its name.
+
+        Cached results are therefore kept after files are renamed or moved, shared by
+        identical copies of files, and invalidated by new versions of models.
+        """
+        if filename not in batch_signatures:
+            try:
+                # workers should not write to the manifest, which is held by the main process
+                batch_signatures[filename] = get_file_hash(filename, save=False)
+            except OSError:
+                return self._path_cache_key(filename)
+        return (
+            "classify",
+            self.fullname,
+            get_package_version(self.package),
+            batch_signatures[filename],
+        )
+
+    def _path_cache_key(self, filename: Path) -> Tuple[str, ...]:
+        """Key of results cached by earlier versions, which are used if found by file name."""
         return (self.feature, self.model_name or "", self.model_option or "", str(filename))
 
     def _classify(self, filename: Path) -> List[Dict[str, Any]]:
         raise NotImplementedError()
 
+    def _classify_batch(self, filenames: List[Path]) -> List[List[Dict[str, Any]]]:
+        """Classify images one by one, unless the model supports batched inference."""
+        return [self._classify(x) for x in filenames]
+
     def _filter_tags(self, res: List[Dict[str, Any]]) -> Dict[str, Any]:
         raise NotImplementedError()
 
     def classify(self, filename: Path) -> Dict[str, Any]:
-        key = self._cache_key(filename)
-        res = cache.get(key, None)
-        if not res:
-            res = self._classify(filename)
-            # if detection failed, the picture will be detected again and again
-            # which might not be a good idea
-            if res:
-                cache.set(key, res, tag="classify")
+        return self.classify_batch([filename])[0]
+
+    def classify_batch(self, filenames: List[Path]) -> List[Dict[str, Any]]:
+        """Classify images with cached results, and images without in one batch."""
+        keys = [self._cache_key(x) for x in filenames]
+        results = [cache.get(key, None) for key in keys]
+        for idx, (filename, key) in enumerate(zip(filenames, keys)):
+            if not results[idx] and key != self._path_cache_key(filename):
+                results[idx] = cache.get(self._path_cache_key(filename), None)
+                if results[idx]:
+                    cache.set(key, results[idx], tag="classify")
+        missing = [idx for idx, res in enumerate(results) if not res]
+        if missing:
+            for idx, res in zip(missing, self._classify_batch([filenames[i] for i in missing])):
+                results[idx] = res
+                # if detection failed, the picture will be detected again and again
+                # which might not be a good idea
+                if res:
+                    cache.set(keys[idx], res, tag="classify")
         if self.logger is not None:
-            self.logger.debug(
-                f"{filename=} model={self.fullname}:{self.model_option or 'default'} {res=}"
-            )
-        return self._filter_tags(res)
+            for filename, res in zip(filenames, results):
+                self.logger.debug(
+                    f"{filename=} model={self.fullname}:{self.model_option or 'default'} {res=}"
+                )
+        return [self._filter_tags(res or []) for res in results]
 
 
 class NSFWClassifier(Classifier):
     feature = "nsfw"
     default_model = "nudenet"
     allowed_models = ("nudenet",)
+    package = "nudenet"
     default_option = ""
     allowed_options = ()
 
@@ -215,17 +358,33 @@ class NSFWClassifier(Classifier):
         "BUTTOCKS_COVERED",
     )
 
-    def _classify(self, filename: Path) -> List[Dict[str, Any]]:
+    def _load_model(self) -> Any:
         from nudenet import NudeDetector  # type: ignore
 
-        detector = NudeDetector()
+        return NudeDetector()
+
+    def _classify(self, filename: Path) -> List[Dict[str, Any]]:
         try:
-            return cast(List[Dict[str, Any]], detector.detect(str(filename)))
+            return cast(List[Dict[str, Any]], self.model.detect(str(filename)))
         except Exception as e:
             if self.logger:
                 self.logger.debug(f"Error classifying {filename}: {e}")
             return []
 
+    def _classify_batch(self, filenames: List[Path]) -> List[List[Dict[str, Any]]]:
+        if len(filenames) == 1 or not hasattr(self.model, "detect_batch"):
+            return super()._classify_batch(filenames)
+        try:
+            return cast(
+                List[List[Dict[str, Any]]],
+                self.model.detect_batch([str(x) for x in filenames], batch_size=len(filenames)),
+            )
+        except Exception as e:
+            # classify images one by one so that one bad image does not fail the batch
+            if self.logger:
+                self.logger.debug(f"Error classifying {len(filenames)} images in batch: {e}")
+            return super()._classify_batch(filenames)
+
     def _filter_tags(self, res: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {
             x["class"] + self.suffix: {k: v for k, v in x.items() if k != "class"}
@@ -270,6 +429,7 @@ class FaceClassifier(Classifier):
     feature = "face"
     default_model = "deepface"
     allowed_models = ("deepface",)
+    package = "deepface"
     default_option = "opencv"
     allowed_options = deepface_backends
     labels = ("face",)
@@ -309,15 +469,45 @@ class FaceClassifier(Classifier):
         }
 
 
-class AgeClassifier(Classifier):
-    feature = "age"
+class DeepFaceAnalyzeClassifier(Classifier):
+    """Classifiers of facial attributes that share one DeepFace.analyze call per image.
+
+    Faces of an image are detected and analyzed once, for all actions of classifiers with
+    the same backend that do not have cached results, and the results are split by
+    result_keys of each classifier.
+    """
+
     default_model = "deepface"
     allowed_models = ("deepface",)
+    package = "deepface"
     default_option = "opencv"
     allowed_options = deepface_backends
-    labels = ("baby", "toddler", "teenager", "adult", "elderly")
+    result_keys: Tuple[str, ...] = ()
+    # keys for the detected face, which are shared by all actions
+    face_keys = ("region", "face_confidence")
 
     def _classify(self, filename: Path) -> List[Dict[str, Any]]:
+        key = (str(filename), self.model_option)
+        if key not in analyzed_faces:
+            if self in classifiers:
+                analyzers = [
+                    x
+                    for x in classifiers
+                    if isinstance(x, DeepFaceAnalyzeClassifier)
+                    and x.model_option == self.model_option
+                    and (x is self or not cache.get(x._cache_key(filename), None))
+                ]
+            else:
+                analyzers = [self]
+            actions = list(dict.fromkeys(x.feature for x in analyzers))
+            analyzed_faces[key] = self._analyze(filename, actions)
+        return [
+            {k: v for k, v in face.items() if k in self.result_keys or k in self.face_keys}
+            for face in analyzed_faces[key]
+            if self.feature in face
+        ]
+
+    def _analyze(self, filename: Path, actions: List[str]) -> List[Dict[str, Any]]:
         from deepface import DeepFace  # type: ignore
 
         try:
@@ -325,7 +515,7 @@ class AgeClassifier(Classifier):
                 List[Dict[str, Any]],
                 DeepFace.analyze(
                     img_path=str(filename),
-                    actions=["age"],
+                    actions=actions,
                     detector_backend=self.model_option,
                 ),
             )
@@ -334,6 +524,12 @@ class AgeClassifier(Classifier):
                 self.logger.debug(f"Error classifying {filename}: {e}")
             return []
 
+
+class AgeClassifier(DeepFaceAnalyzeClassifier):
+    feature = "age"
+    labels = ("baby", "toddler", "teenager", "adult", "elderly")
+    result_keys = ("age",)
+
     def _filter_tags(self, res: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {
             get_age_label(x["age"]) + self.suffix: np_to_scalar(x) | {"model": self.fullname}
@@ -342,31 +538,10 @@ class AgeClassifier(Classifier):
         }
 
 
-class GenderClassifier(Classifier):
+class GenderClassifier(DeepFaceAnalyzeClassifier):
     feature = "gender"
-    default_model = "deepface"
-    allowed_models = ("deepface",)
-    default_option = "opencv"
-    allowed_options = deepface_backends
     labels = ("Woman", "Man")
-
-    def _classify(self, filename: Path) -> List[Dict[str, Any]]:
-        from deepface import DeepFace  # type: ignore
-
-        try:
-            return cast(
-                List[Dict[str, Any]],
-                DeepFace.analyze(
-                    img_path=str(filename),
-                    actions=["gender"],
-                    detector_backend=self.model_option,
-                    force_detection=True,
-                ),
-            )
-        except Exception as e:
-            if self.logger:
-                self.logger.debug(f"Error classifying {filename}: {e}")
-            return []
+    result_keys = ("gender", "dominant_gender")
 
     def _filter_tags(self, res: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {
@@ -382,30 +557,10 @@ class GenderClassifier(Classifier):
         }
 
 
-class RaceClassifier(Classifier):
+class RaceClassifier(DeepFaceAnalyzeClassifier):
     feature = "race"
-    default_model = "deepface"
-    allowed_models = ("deepface",)
-    default_option = "opencv"
-    allowed_options = deepface_backends
     labels = ("asian", "indian", "black", "white", "middle eastern", "latino hispanic")
-
-    def _classify(self, filename: Path) -> List[Dict[str, Any]]:
-        from deepface import DeepFace  # type: ignore
-
-        try:
-            return cast(
-                List[Dict[str, Any]],
-                DeepFace.analyze(
-                    img_path=str(filename),
-                    actions=["race"],
-                    detector_backend=self.model_option,
-                ),
-            )
-        except Exception as e:
-            if self.logger:
-                self.logger.debug(f"Error classifying {filename}: {e}")
-            return []
+    result_keys = ("race", "dominant_race")
 
     def _filter_tags(self, res: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {
@@ -421,31 +576,10 @@ class RaceClassifier(Classifier):
         }
 
 
-class EmotionClassifier(Classifier):
+class EmotionClassifier(DeepFaceAnalyzeClassifier):
     feature = "emotion"
-    default_model = "deepface"
-    allowed_models = ("deepface",)
-    default_option = "opencv"
-    allowed_options = deepface_backends
     labels = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
-
-    def _classify(self, filename: Path) -> List[Dict[str, Any]]:
-        from deepface import DeepFace  # type: ignore
-
-        try:
-            return cast(
-                List[Dict[str, Any]],
-                DeepFace.analyze(
-                    img_path=str(filename),
-                    actions=["emotion"],
-                    detector_backend=self.model_option,
-                    enforce_detection=True,
-                ),
-            )
-        except Exception as e:
-            if self.logger:
-                self.logger.debug(f"Error classifying {filename}: {e}")
-            return []
+    result_keys = ("emotion", "dominant_emotion")
 
     def _filter_tags(self, res: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {
@@ -511,5 +645,13 @@ def get_classify_parser(subparsers: argparse._SubParsersAction) -> argparse.Argu
         action="store_true",
         help="Remove all existing tags.",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=16,
+        help="""Number of images that are sent to each worker process. Only the nudenet
+            model of nsfw classifies each batch with batched inference, and other models
+            classify the images of a batch one by one.""",
+    )
     parser.set_defaults(func=classify, command="classify")
     return parser
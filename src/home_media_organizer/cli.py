@@ -13,6 +13,7 @@ from .compare import get_compare_parser
 from .config import Config
 from .dedup import get_dedup_parser
 from .list import get_list_parser
+from .media_file import filename_date_patterns
 from .organize import get_organize_parser
 from .remove_tags import get_remove_tags_parser
 from .rename import get_rename_parser
@@ -21,7 +22,7 @@ from .set_tags import get_set_tags_parser
 from .shift_exif import get_shift_exif_parser
 from .show_exif import get_show_exif_parser
 from .show_tags import get_show_tags_parser
-from .utils import manifest
+from .utils import exiftool_pool, manifest, parse_date_range
 from .validate import get_validate_parser
 
 
@@ -42,8 +43,8 @@ def add_common_arguments(subparser: argparse.ArgumentParser) -> None:
         "--with-tags",
         nargs="*",
         help="""Process only media files with specified tag, one of the tags if multiple value are provided,
-            or any tag if no value is specified. Logical expressions such as 'baby AND happy' are
-            supported.""",
+            or any tag if no value is specified. Logical expressions such as 'baby AND happy' and
+            '(baby OR toddler) AND NOT sad' are supported.""",
     )
     parser.add_argument(
         "--without-tags",
@@ -65,6 +66,24 @@ def add_common_arguments(subparser: argparse.ArgumentParser) -> None:
             "key" and wildcard character "*" in key are supported.
         """,
     )
+    parser.add_argument(
+        "--date-range",
+        type=parse_date_range,
+        help="""Process only media files with dates in specified range, in the format of
+            YYYY[-MM[-DD]]..YYYY[-MM[-DD]] with optional start or end, such as 2019-01..2019-06,
+            or a single year, month, or day.""",
+    )
+    parser.add_argument(
+        "--from-manifest",
+        action=argparse.BooleanOptionalAction,
+        help="""List files under specified directories from the manifest database instead of
+            scanning the directories. This is the default if --with-tags is specified.""",
+    )
+    parser.add_argument(
+        "--assume-exists",
+        action="store_true",
+        help="""Do not check if files listed from the manifest database still exist.""",
+    )
     parser.add_argument(
         "-c",
         "--config",
@@ -147,6 +166,24 @@ def parse_args(arg_list: Optional[List[str]]) -> argparse.Namespace:
             if getattr(args, k, None) is not None:
                 continue
             setattr(args, k, v)
+    # patterns of filenames with dates, which take priority over built-in patterns
+    if getattr(args, "filename_date_patterns", None):
+        try:
+            filename_date_patterns.add(
+                (x["pattern"], x["format"]) for x in args.filename_date_patterns
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            parser.error(
+                f"Invalid filename-date-patterns {args.filename_date_patterns}, which should be a list of "
+                f"tables with keys pattern and format: {e}"
+            )
+    # values from configuration files are not converted by argparse
+    date_range = getattr(args, "date_range", None)
+    if date_range is not None and not isinstance(date_range, tuple):
+        try:
+            args.date_range = parse_date_range(str(date_range))
+        except ValueError as e:
+            parser.error(f"Invalid date-range {date_range}: {e}")
     #
     if args.batch is True:
         args.confirmed = True
@@ -174,6 +211,7 @@ def app(arg_list: Optional[List[str]] = None) -> int:
 
     logger = logging.getLogger(args.command)
     manifest.init_db(args.manifest, logger=logger)
+    exiftool_pool.size = args.jobs
 
     # calling the associated functions
     try:
@@ -2,13 +2,15 @@ import argparse
 import logging
 from collections import defaultdict
 from enum import Enum
+from functools import partial
 from multiprocessing import Pool
+from pathlib import Path
 from typing import List
 
 from tqdm import tqdm  # type: ignore
 
+from .dedup import get_file_md5
 from .home_media_organizer import iter_files
-from .utils import clear_cache, get_file_hash
 
 
 class CompareBy(Enum):
@@ -26,9 +28,6 @@ class CompareOutput(Enum):
 # compare: compare two sets of files or directories
 #
 def compare_files(args: argparse.Namespace, logger: logging.Logger | None) -> None:
-    if args.no_cache:
-        clear_cache(tag="compare")
-
     a_sig_to_files = defaultdict(list)
     b_sig_to_files = defaultdict(list)
     a_file_to_sig = {}
@@ -37,10 +36,11 @@ def compare_files(args: argparse.Namespace, logger: logging.Logger | None) -> No
     a_files = args.items
     b_files = args.A_and_B or args.A_or_B or args.A_only or args.B_only
 
+    get_signature = partial(get_file_md5, refresh=args.no_cache)
     with Pool(args.jobs or None) as pool:
-        # get file size
+        # get file signature
         for filename, md5 in tqdm(
-            pool.imap(get_file_hash, iter_files(args, a_files)), desc="Checking A file signature"
+            pool.imap(get_signature, iter_files(args, a_files)), desc="Checking A file signature"
         ):
             if args.by == CompareBy.CONTENT.value:
                 a_sig_to_files[md5].append(filename)
@@ -50,7 +50,7 @@ def compare_files(args: argparse.Namespace, logger: logging.Logger | None) -> No
                 a_file_to_sig[filename] = (md5, filename.name)
         #
         for filename, md5 in tqdm(
-            pool.imap(get_file_hash, iter_files(args, b_files)), desc="Checking B file signature"
+            pool.imap(get_signature, iter_files(args, b_files)), desc="Checking B file signature"
         ):
             if args.by == CompareBy.CONTENT.value:
                 b_sig_to_files[md5].append(filename)
@@ -59,13 +59,15 @@ def compare_files(args: argparse.Namespace, logger: logging.Logger | None) -> No
                 b_sig_to_files[(md5, filename.name)].append(filename)
                 b_file_to_sig[filename] = (md5, filename.name)
 
-    def print_files(files_a: List[str], files_b: List[str]) -> None:
+    def print_files(files_a: List[Path], files_b: List[Path]) -> None:
+        names_a = [str(x) for x in files_a]
+        names_b = [str(x) for x in files_b]
         if args.output == CompareOutput.A.value:
-            print("=".join(files_a) if files_a else "=".join(files_b))
+            print("=".join(names_a) if names_a else "=".join(names_b))
         elif args.output == CompareOutput.B.value:
-            print("=".join(files_b) if files_b else "=".join(files_a))
+            print("=".join(names_b) if names_b else "=".join(names_a))
         elif args.output == CompareOutput.BOTH.value:
-            print("=".join(files_a + files_b))
+            print("=".join(names_a + names_b))
         else:
             raise ValueError(f"Invalid value for --output: {args.output}")
 
@@ -122,7 +124,8 @@ def get_compare_parser(subparsers: argparse._SubParsersAction) -> argparse.Argum
     parser_compare.add_argument(
         "--no-cache",
         action="store_true",
-        help="invalidate cached file signatures and re-examine all file content.",
+        help="""Ignore cached file signatures and re-examine all file content. By default
+            only files that have been changed since they were last examined are re-hashed.""",
     )
     action_parser = parser_compare.add_mutually_exclusive_group(required=True)
     action_parser.add_argument(
@@ -2,15 +2,18 @@ import argparse
 import logging
 import os
 from collections import defaultdict
+from functools import partial
 from multiprocessing import Pool
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Callable, Dict, List, Set, Tuple
 
+import numpy as np
+from PIL import Image, UnidentifiedImageError
 from rich.prompt import Prompt
 from tqdm import tqdm  # type: ignore
 
 from .home_media_organizer import iter_files
-from .utils import clear_cache, get_file_hash
+from .utils import calculate_partial_hash, get_file_hash, manifest
 
 
 #
@@ -20,15 +23,103 @@ def get_file_size(filename: Path) -> Tuple[Path, int]:
     return (filename, filename.stat().st_size)
 
 
-def get_file_md5(filename: Path) -> Tuple[Path, str]:
-    return (filename, get_file_hash(filename.resolve()))
+def get_file_md5(filename: Path, refresh: bool = False) -> Tuple[Path, str]:
+    return (filename, get_file_hash(filename.resolve(), refresh=refresh))
 
 
-def remove_duplicated_files(args: argparse.Namespace, logger: logging.Logger | None) -> None:
-    if args.no_cache:
-        clear_cache(tag="dedup")
+def get_file_partial_md5(filename: Path, chunk_size: int = 65536) -> Tuple[Path, str]:
+    return (filename, calculate_partial_hash(filename.resolve(), chunk_size=chunk_size))
+
+
+def get_image_dhash(filename: Path, hash_size: int = 8) -> int:
+    """Calculate difference hash (dHash) of an image.
+
+    The image is decoded at reduced resolution, converted to a (hash_size + 1) x hash_size
+    grayscale thumbnail, and each bit of the hash records if a pixel is brighter than its
+    neighbor to the right.
+    """
+    with Image.open(filename) as img:
+        # let JPEG decoder scale down the image during decoding
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        thumbnail = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    return int.from_bytes(np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes(), "big")
+
+
+def get_file_perceptual_hash(filename: Path, refresh: bool = False) -> Tuple[Path, int | None]:
+    stat = filename.stat()
+    hash_value = None if refresh else manifest.get_perceptual_hash(stat)
+    if hash_value is None:
+        try:
+            hash_value = f"{get_image_dhash(filename):016x}"
+        except (UnidentifiedImageError, OSError, ValueError):
+            # record files that cannot be hashed so that they are not tried again
+            hash_value = ""
+        manifest.set_perceptual_hash(stat, hash_value)
+    return (filename, int(hash_value, 16) if hash_value else None)
+
+
+def find_similar_files(
+    hashes: Dict[Path, int],
+    max_distance: int,
+    hash_bits: int = 64,
+    key: Callable[[Path], Any] | None = None,
+) -> List[List[Path]]:
+    """Group files with perceptual hashes that differ by at most max_distance bits.
+
+    Hashes are split into max_distance + 1 blocks. By the pigeonhole principle, two hashes
+    within max_distance bits of each other share at least one identical block, so only
+    hashes that fall into the same bucket of a block need to be compared.
 
+    Similarity is not transitive, so each group is built around the file that is kept,
+    which is the largest file by key and is returned as the last item of the group. The
+    other files of the group are all within max_distance bits of the kept file.
+    """
+    files_by_hash: Dict[int, List[Path]] = defaultdict(list)
+    for filename, hash_value in hashes.items():
+        files_by_hash[hash_value].append(filename)
+    unique_hashes = list(files_by_hash)
+    hash_index = {hash_value: idx for idx, hash_value in enumerate(unique_hashes)}
+
+    n_blocks = max_distance + 1
+    bounds = [hash_bits * i // n_blocks for i in range(n_blocks + 1)]
+    buckets: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+    for idx, hash_value in enumerate(unique_hashes):
+        for block, (low, high) in enumerate(zip(bounds[:-1], bounds[1:])):
+            buckets[(block, (hash_value >> low) & ((1 << (high - low)) - 1))].append(idx)
+
+    neighbors: List[Set[int]] = [{idx} for idx in range(len(unique_hashes))]
+    for members in buckets.values():
+        for i, idx_a in enumerate(members):
+            for idx_b in members[i + 1 :]:
+                if idx_b in neighbors[idx_a]:
+                    continue
+                if (unique_hashes[idx_a] ^ unique_hashes[idx_b]).bit_count() <= max_distance:
+                    neighbors[idx_a].add(idx_b)
+                    neighbors[idx_b].add(idx_a)
+
+    sort_key = key or str
+    grouped: Set[Path] = set()
+    groups = []
+    for kept in sorted(hashes, key=sort_key, reverse=True):
+        if kept in grouped:
+            continue
+        grouped.add(kept)
+        similar = [
+            filename
+            for idx in neighbors[hash_index[hashes[kept]]]
+            for filename in files_by_hash[unique_hashes[idx]]
+            if filename not in grouped
+        ]
+        if similar:
+            grouped.update(similar)
+            groups.append([*sorted(similar, key=sort_key), kept])
+    return groups
+
+
+def find_duplicated_files(args: argparse.Namespace) -> List[List[Path]]:
     md5_files = defaultdict(list)
+    partial_files = defaultdict(list)
     size_files = defaultdict(list)
 
     with Pool(args.jobs or None) as pool:
@@ -38,30 +129,72 @@ def remove_duplicated_files(args: argparse.Namespace, logger: logging.Logger | N
         ):
             size_files[filesize].append(filename)
         #
-        # get md5 for files with the same size
+        # get partial md5 (head, middle, and tail) for files with the same size
         potential_duplicates = [file for x in size_files.values() if len(x) > 1 for file in x]
+        file_sizes = {file: size for size, x in size_files.items() for file in x}
+        for filename, partial_md5 in tqdm(
+            pool.imap(
+                partial(get_file_partial_md5, chunk_size=args.chunk_size), potential_duplicates
+            ),
+            desc="Checking partial file content",
+        ):
+            partial_files[(file_sizes[filename], partial_md5)].append(filename)
+        #
+        # get md5 for files with the same size and partial md5. Small files are hashed in
+        # full by the partial md5 so there is no need to read them again.
+        potential_duplicates = []
+        for (size, md5), files in partial_files.items():
+            if len(files) == 1:
+                continue
+            if size <= 3 * args.chunk_size:
+                md5_files[md5].extend(files)
+            else:
+                potential_duplicates.extend(files)
         for filename, md5 in tqdm(
-            pool.imap(get_file_md5, potential_duplicates),
+            pool.imap(partial(get_file_md5, refresh=args.no_cache), potential_duplicates),
             desc="Checking file content",
         ):
             md5_files[md5].append(filename)
+    # keep the one with the deepest path name
+    return [
+        sorted(files, key=lambda x: len(str(x))) for files in md5_files.values() if len(files) > 1
+    ]
+
 
+def find_similar_media(args: argparse.Namespace) -> List[List[Path]]:
+    hashes = {}
+    with Pool(args.jobs or None) as pool:
+        for filename, hash_value in tqdm(
+            pool.imap(partial(get_file_perceptual_hash, refresh=args.no_cache), iter_files(args)),
+            desc="Checking image content",
+        ):
+            if hash_value is not None:
+                hashes[filename] = hash_value
+    # keep the largest file, which is likely the original copy
+    return find_similar_files(
+        hashes, args.max_distance, key=lambda x: (x.stat().st_size, len(str(x)))
+    )
+
+
+def remove_duplicated_files(args: argparse.Namespace, logger: logging.Logger | None) -> None:
+    if args.similar:
+        groups = find_similar_media(args)
+        description = "similar content"
+        relation = "is similar to"
+    else:
+        groups = find_duplicated_files(args)
+        description = "the same content"
+        relation = "is a duplicated copy of"
     #
     duplicated_cnt = 0
     removed_cnt = 0
-    for files in md5_files.values():
-        if len(files) == 1:
-            continue
-        # keep the one with the deepest path name
-        duplicated_cnt += len(files) - 1
-        sorted_files = sorted(files, key=lambda x: len(str(x)))
+    for sorted_files in groups:
+        duplicated_cnt += len(sorted_files) - 1
 
         if args.confirmed is not None:
             for filename in sorted_files[:-1]:
                 if logger is not None:
-                    logger.info(
-                        f"[red]{filename}[/red] is a duplicated copy of {sorted_files[-1]} "
-                    )
+                    logger.info(f"[red]{filename}[/red] {relation} {sorted_files[-1]} ")
                 if args.confirmed is False:
                     if logger is not None:
                         logger.info(f"[green]DRYRUN[/green] Would remove {filename}")
@@ -72,7 +205,7 @@ def remove_duplicated_files(args: argparse.Namespace, logger: logging.Logger | N
                     removed_cnt += 1
         else:
             # ask which file that user would like to keep
-            msg = f"\nThe following [red]{len(files)}[/red] files have the same content:\n"
+            msg = f"\nThe following [red]{len(sorted_files)}[/red] files have {description}:\n"
             choices = []
             for idx, filename in enumerate(sorted_files):
                 if idx == len(sorted_files) - 1:
@@ -107,7 +240,29 @@ def get_dedup_parser(subparsers: argparse._SubParsersAction) -> argparse.Argumen
     parser.add_argument(
         "--no-cache",
         action="store_true",
-        help="invalidate cached file signatures and re-examine all file content.",
+        help="""Ignore cached file signatures and re-examine all file content. By default
+            only files that have been changed since they were last examined are re-hashed.""",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=65536,
+        help="""Size of the head, middle, and tail blocks that are compared before the
+            entire content of files with the same size is examined.""",
+    )
+    parser.add_argument(
+        "--similar",
+        action="store_true",
+        help="""Find images that look similar, such as resized, re-encoded, or EXIF-edited
+            copies of the same photo, instead of files with identical content. The largest
+            file of each group of similar images is kept by default.""",
+    )
+    parser.add_argument(
+        "--max-distance",
+        type=int,
+        default=4,
+        help="""Maximum number of different bits between the 64-bit perceptual hashes of two
+            images for them to be considered similar, used with option --similar.""",
     )
     parser.set_defaults(func=remove_duplicated_files, command="dedup")
     return parser
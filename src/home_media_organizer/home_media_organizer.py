@@ -3,17 +3,52 @@ import fnmatch
 import os
 import sys
 import threading
+from bisect import bisect_left
 from logging import Logger
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from queue import Queue
-from typing import Any, Callable, Dict, Generator, List
+from typing import Any, Callable, Dict, Generator, Iterable, List, Tuple
 
 import rich
-from exiftool import ExifToolHelper  # type: ignore
-from tqdm import tqdm  # type: ignore
 
-from .media_file import date_func
-from .utils import manifest
+from .media_file import MediaFile, date_func
+from .utils import get_exif_metadata, manifest
+
+
+class PathIndex:
+    """A sorted collection of absolute filenames.
+
+    Files under a directory form a contiguous range of the sorted names, so checking if a
+    directory contains any of the files, or listing them, only needs a binary search.
+    """
+
+    def __init__(self: "PathIndex", filenames: Iterable[str]) -> None:
+        self.filenames = sorted(filenames)
+        self._filenames = set(self.filenames)
+
+    def __contains__(self: "PathIndex", filename: str) -> bool:
+        return filename in self._filenames
+
+    def __len__(self: "PathIndex") -> int:
+        return len(self.filenames)
+
+    def _range(self: "PathIndex", directory: str) -> Tuple[int, int]:
+        prefix = os.path.join(directory, "")
+        # names starting with prefix are sorted before prefix with its last separator
+        # replaced by the next character
+        return (
+            bisect_left(self.filenames, prefix),
+            bisect_left(self.filenames, prefix[:-1] + chr(ord(prefix[-1]) + 1)),
+        )
+
+    def has_files_under(self: "PathIndex", directory: str) -> bool:
+        start, end = self._range(directory)
+        return start < end
+
+    def files_under(self: "PathIndex", directory: str) -> List[str]:
+        start, end = self._range(directory)
+        return self.filenames[start:end]
 
 
 def iter_files(
@@ -67,10 +102,77 @@ def iter_files(
                     match = False
         return match
 
+    def allowed_date(filename: Path) -> bool:
+        if date_range is None:
+            return True
+        if from_manifest:
+            return str(filename) in files_in_date_range
+        try:
+            date = MediaFile(filename).resolve_date()
+        except OSError:
+            return False
+        if date is None or not date_range[0] <= date < date_range[1]:
+            if logger is not None:
+                logger.debug(f"Ignoring {filename} due to failed --date-range matching.")
+            return False
+        return True
+
+    def iter_manifest_files(directory: Path) -> Generator[Path, None, None]:
+        # list files under directory from the manifest instead of walking the directory
+        if args.with_tags is not None:
+            filenames = files_with_tags.files_under(str(directory))
+        elif date_range is not None:
+            filenames = files_in_date_range.files_under(str(directory))
+        else:
+            filenames = manifest.find_files_under(str(directory))
+        candidates = [
+            Path(x)
+            for x in filenames
+            if allowed_filetype(Path(Path(x).name))
+            and (args.without_tags is None or x not in files_with_unwanted_tags)
+            and allowed_date(Path(x))
+        ]
+        if not getattr(args, "assume_exists", False):
+            # stat files in parallel because each stat can be a round trip to a network drive
+            with ThreadPool(args.jobs or 10) as pool:
+                existing = []
+                for candidate, exists in zip(
+                    candidates, pool.imap(os.path.isfile, candidates, chunksize=64)
+                ):
+                    if exists:
+                        existing.append(candidate)
+                    elif logger is not None:
+                        logger.debug(f"Ignoring {candidate} because it no longer exists.")
+            candidates = existing
+        if not (args.with_exif or args.without_exif):
+            yield from candidates
+            return
+        # get exif of files in batches
+        for i in range(0, len(candidates), 100):
+            batch = candidates[i : i + 100]
+            all_metadata = get_exif_metadata(batch)
+            for qualified_file, metadata in zip(batch, all_metadata):
+                if allowed_metadata(
+                    {x: y for x, y in metadata.items() if not x.startswith("File:")}
+                ):
+                    yield qualified_file
+
+    # files are listed from the manifest if requested, or by default if only files
+    # with specified tags will be processed
+    from_manifest = getattr(args, "from_manifest", None)
+    if from_manifest is None:
+        from_manifest = args.with_tags is not None
+
+    # dates are looked up from the manifest index if files are listed from the manifest,
+    # and are resolved and saved to the manifest otherwise
+    date_range = getattr(args, "date_range", None)
+    if date_range is not None and from_manifest:
+        files_in_date_range = PathIndex(manifest.find_files_by_date(*date_range))
+
     if args.with_tags is not None:
-        files_with_tags = {x.filename for x in manifest.find_by_tags(args.with_tags)}
+        files_with_tags = PathIndex(manifest.find_files_by_tags(args.with_tags))
     if args.without_tags is not None:
-        files_with_unwanted_tags = {x.filename for x in manifest.find_by_tags(args.without_tags)}
+        files_with_unwanted_tags = manifest.find_files_by_tags(args.without_tags)
 
     for item in items or args.items:
         # if item is an absolute path, use it directory
@@ -103,7 +205,7 @@ def iter_files(
             rich.print(f"[red]{item} not found in current directory[/red]")
             sys.exit(1)
         if item.is_file():
-            if not allowed_filetype(item):
+            if not allowed_filetype(item) or not allowed_date(item):
                 continue
             if args.with_tags is not None and str(item) not in files_with_tags:
                 if logger is not None:
@@ -114,12 +216,11 @@ def iter_files(
                     logger.debug(f"Ignoring {item} due to failed --without-tags matching.")
                 continue
             if args.with_exif or args.without_exif:
-                with ExifToolHelper() as e:
-                    metadata = {
-                        x: y
-                        for x, y in e.get_metadata(item.resolve())[0].items()
-                        if not x.startswith("File:")
-                    }
+                metadata = {
+                    x: y
+                    for x, y in get_exif_metadata([item.resolve()])[0].items()
+                    if not x.startswith("File:")
+                }
                 if not allowed_metadata(metadata):
                     if logger is not None:
                         logger.debug(
@@ -131,16 +232,23 @@ def iter_files(
             if not item.is_dir():
                 rich.print(f"[red]{item} is not a filename or directory[/red]")
                 continue
-            for root, _, files in os.walk(item):
-                # if with_tags if specified, check if any of the files_with_tags is under root
-                if args.with_tags is not None and not any(
-                    f.startswith(root) for f in files_with_tags
-                ):
-                    if logger is not None:
-                        logger.debug(
-                            f"Ignoring {root} because no files under this directory has matching tag."
-                        )
-                    continue
+            if from_manifest:
+                yield from iter_manifest_files(item)
+                continue
+            for root, dirs, files in os.walk(item):
+                # if with_tags if specified, do not descend into directories without
+                # any of the files_with_tags
+                if args.with_tags is not None:
+                    if not files_with_tags.has_files_under(root):
+                        if logger is not None:
+                            logger.debug(
+                                f"Ignoring {root} because no files under this directory has matching tag."
+                            )
+                        dirs[:] = []
+                        continue
+                    dirs[:] = [
+                        x for x in dirs if files_with_tags.has_files_under(os.path.join(root, x))
+                    ]
                 rootpath = Path(root)
                 if args.with_exif or args.without_exif:
                     # get exif atll at the same time
@@ -148,6 +256,7 @@ def iter_files(
                         rootpath / f
                         for f in files
                         if allowed_filetype(Path(f))
+                        and allowed_date(rootpath / f)
                         and (args.with_tags is None or str(rootpath / f) in files_with_tags)
                         and (
                             args.without_tags is None
@@ -156,13 +265,12 @@ def iter_files(
                     ]
                     if not qualified_files:
                         continue
-                    with ExifToolHelper() as e:
-                        all_metadata = e.get_metadata(files=qualified_files)
-                        for qualified_file, metadata in zip(qualified_files, all_metadata):
-                            if allowed_metadata(
-                                {x: y for x, y in metadata.items() if not x.startswith("File:")}
-                            ):
-                                yield qualified_file
+                    all_metadata = get_exif_metadata(qualified_files)
+                    for qualified_file, metadata in zip(qualified_files, all_metadata):
+                        if allowed_metadata(
+                            {x: y for x, y in metadata.items() if not x.startswith("File:")}
+                        ):
+                            yield qualified_file
                 else:
                     for f in files:
                         if (
@@ -176,7 +284,7 @@ def iter_files(
                                     f"Ignoring {rootpath/f} due to failed --with-tags or --without-tags matching."
                                 )
                             continue
-                        if allowed_filetype(Path(f)):
+                        if allowed_filetype(Path(f)) and allowed_date(rootpath / f):
                             yield rootpath / f
 
 
@@ -195,16 +303,3 @@ class Worker(threading.Thread):
             self.task(item)
             self.queue.task_done()
 
-
-def process_with_queue(args: argparse.Namespace, func: Callable) -> None:
-    q: Queue[str] = Queue()
-    # Create worker threads
-    num_workers = args.jobs or 10
-    for _ in range(num_workers):
-        t = Worker(q, func)
-        t.start()
-
-    for item in (pbar := tqdm(iter_files(args))):
-        pbar.set_description(f"Processing {item.name}")
-        q.put(item)
-    q.join()
@@ -1,19 +1,24 @@
 """Main module."""
 
-import filecmp
 import os
 import re
-import shutil
+import struct
+from contextlib import suppress
 from datetime import datetime, timedelta
 from logging import Logger
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, BinaryIO, Dict, Generator, Iterable, List, Optional, Tuple
 
 import inflect
-from exiftool import ExifToolHelper  # type: ignore
 from PIL import Image, UnidentifiedImageError
 
-from .utils import OrganizeOperation, get_response, manifest
+from .utils import (
+    exiftool_pool,
+    get_exif_metadata,
+    get_response,
+    manifest,
+)
 
 
 def image_date(filename: Path) -> str | None:
@@ -29,129 +34,378 @@ def image_date(filename: Path) -> str | None:
         return None
 
 
-def exiftool_date(filename: Path) -> str | None:
-    with ExifToolHelper() as e:
-        metadata = e.get_metadata(filename)[0]
-        if "QuickTime:MediaModifyDate" in metadata:
-            return str(metadata["QuickTime:MediaModifyDate"])
-        if "QuickTime:MediaCreateDate" in metadata:
-            return str(metadata["QuickTime:MediaCreateDate"])
-        if "EXIF:DateTimeOriginal" in metadata:
-            return str(metadata["EXIF:DateTimeOriginal"])
-        if "Composite:DateTimeOriginal" in metadata:
-            return str(metadata["Composite:DateTimeOriginal"])
+exif_date_pattern = re.compile(r"\d{4}:\d{2}:\d{2} \d{2}:\d{2}:\d{2}")
+
+
+def _tiff_date(data: bytes) -> str | None:
+    """Return DateTimeOriginal from EXIF data, which is structured as a TIFF file."""
+    order = {b"II": "<", b"MM": ">"}.get(data[:2])
+    if order is None:
+        return None
+
+    def ifd_entries(offset: int) -> Generator[Tuple[int, int, int, bytes], None, None]:
+        (count,) = struct.unpack_from(order + "H", data, offset)
+        for i in range(count):
+            yield struct.unpack_from(order + "HHI4s", data, offset + 2 + 12 * i)
+
+    (ifd0,) = struct.unpack_from(order + "I", data, 4)
+    for tag, _, _, value in ifd_entries(ifd0):
+        if tag == 0x8769:  # pointer to Exif IFD
+            (exif_ifd,) = struct.unpack(order + "I", value)
+            break
+    else:
+        return None
+    for tag, field_type, count, value in ifd_entries(exif_ifd):
+        if tag == 0x9003 and field_type == 2:  # DateTimeOriginal in ASCII
+            if count > 4:
+                (offset,) = struct.unpack(order + "I", value)
+                value = data[offset : offset + count]
+            date = value[:count].split(b"\0")[0].decode("ascii", errors="replace").strip()
+            return date if exif_date_pattern.fullmatch(date) else None
+    return None
+
+
+def _jpeg_exif(f: BinaryIO) -> bytes | None:
+    """Return EXIF data from the APP1 segment of a JPEG file."""
+    if f.read(2) != b"\xff\xd8":
         return None
+    while True:
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xFF or header[1] in (0xD9, 0xDA):
+            # EXIF should appear before image data
+            return None
+        (length,) = struct.unpack(">H", header[2:])
+        if header[1] == 0xE1:
+            data = f.read(length - 2)
+            if data.startswith(b"Exif\0\0"):
+                return data[6:]
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def _iter_boxes(
+    f: BinaryIO, start: int, end: int
+) -> Generator[Tuple[bytes, int, int], None, None]:
+    """Yield type, start of payload, and end of ISO base media file format boxes."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header[:8])
+        payload = pos + 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", header[8:16])
+            payload = pos + 16
+        elif size == 0:
+            size = end - pos
+        if size < payload - pos:
+            return
+        yield box_type, payload, min(pos + size, end)
+        pos += size
 
 
-def filename_date(filename: Path) -> str:
-    ext = filename.suffix
-    basename = filename.name
+def _find_box(f: BinaryIO, start: int, end: int, box_type: bytes) -> Tuple[int, int] | None:
+    for item_type, payload, box_end in _iter_boxes(f, start, end):
+        if item_type == box_type:
+            return payload, box_end
+    return None
 
-    if re.match(r"\d{4}-\d{2}-\d{2}_\d{2}\.\d{2}.\d{2}" + ext, basename):
-        return Path(basename).stem.replace("-", "").replace(".", "")
 
-    if re.match(
-        r"video-?\d{4}\.\d{2}\.\d{2}_\d{2}-\d{2}-\d{2}" + ext,
-        basename,
+def _heif_exif(f: BinaryIO, size: int) -> bytes | None:
+    """Return EXIF data from the Exif item of a HEIF/HEIC file."""
+    meta = _find_box(f, 0, size, b"meta")
+    if meta is None:
+        return None
+    # meta, iinf, and iloc are full boxes with 4 bytes of version and flags
+    iinf = _find_box(f, meta[0] + 4, meta[1], b"iinf")
+    iloc = _find_box(f, meta[0] + 4, meta[1], b"iloc")
+    if iinf is None or iloc is None:
+        return None
+    f.seek(iinf[0])
+    version = f.read(1)[0]
+    for box_type, payload, box_end in _iter_boxes(
+        f, iinf[0] + (6 if version == 0 else 8), iinf[1]
     ):
-        return Path(basename).stem.replace("-", "").replace(".", "")[5:]
-
-    matched = re.match(r"(\d{8})[_-](.*)" + ext, basename)
-    if matched:
-        fld = matched.groups()
-        return f"{fld[0]:0>8}_{fld[1]}"
-
-    matched = re.match(r"(\d{8})" + ext, basename)
-    if matched:
-        fld = matched.groups()
-        return f"{fld[0]:0>8}"
-
-    matched = re.match(r"IMG_(\d{8})_(\d{6})" + ext, basename)
-    if matched:
-        fld = matched.groups()
-        return f"{fld[0]:0>8}_{fld[1]:1}"
-    matched = re.match(r"IMG_(\d{8})_(\d{6})_\d" + ext, basename)
-    if matched:
-        fld = matched.groups()
-        return f"{fld[0]:0>8}_{fld[1]:1}"
-
-    matched = re.match(r"VID_(\d{8})_(\d{6})" + ext, basename)
-    if matched:
-        fld = matched.groups()
-        return f"{fld[0]:0>8}_{fld[1]:1}"
-
-    matched = re.match(r"PXL_(\d{8})_(\d{9})" + ext, basename)
-    if matched:
-        fld = matched.groups()
-        return f"{fld[0]:0>8}_{fld[1]:1}"
-
-    matched = re.match(
-        r"video-(\d{4})[\.-](\d{1,2})[\.-](\d{1,2})-(.+)" + ext,
-        basename,
-    )
-    if matched:
-        fld = matched.groups()
-        return f"{fld[0]:0>4}{fld[1]:0>2}{fld[2]:0>2}_{fld[3]}"
-
-    matched = re.match(
-        r"(\d{2})[\.-](\d{1,2})[\.-](\d{1,2})-(.+)" + ext,
-        basename,
-    )
-    if matched:
-        fld = matched.groups()
-        return f"20{fld[0]:0>2}{fld[1]:0>2}{fld[2]:0>2}_{fld[3]}"
-
-    matched = re.match(r"(\d{4})-(\d{1,2})-(\d{1,2})-(.{1,3})" + ext, basename)
-    if matched:
-        fld = matched.groups()
-        return f"{fld[0]:0>4}{fld[1]:0>2}{fld[2]:0>2}_{fld[3]}"
-
-    matched = re.match(r"(\d{2})-(\d{2})-(\d{2})_(.*)" + ext, basename)
-    if matched:
-        fld = matched.groups()
-        return f"20{fld[0]:0>2}{fld[1]:0>2}{fld[2]:0>2}_{fld[3]}"
-
-    matched = re.match(r"video-(\d{4})-(\d{2})-(\d{2})" + ext, basename)
-    if matched:
-        fld = matched.groups()
-        return f"{fld[0]:0>4}{fld[1]:0>2}{fld[2]:0>2}"
-
-    matched = re.match(
-        r"voice-(\d{4})-(\d{2})-(\d{2})-(\d{2})-(\d{2})" + ext,
-        basename,
-    )
-    if matched:
-        fld = matched.groups()
-        return f"{fld[0]:0>4}{fld[1]:0>2}{fld[2]:0>2}_{fld[3]:0>2}{fld[4]:0>2}"
-
-    raise ValueError(f"Cannot extract date from filename {filename}")
+        if box_type != b"infe":
+            continue
+        f.seek(payload)
+        data = f.read(min(box_end - payload, 16))
+        if data[0] < 2:
+            continue
+        item_id, item_type = struct.unpack_from(">H2x4s" if data[0] == 2 else ">I2x4s", data, 4)
+        if item_type == b"Exif":
+            exif_id = item_id
+            break
+    else:
+        return None
+    #
+    f.seek(iloc[0])
+    data = f.read(iloc[1] - iloc[0])
+    version = data[0]
+    offset_size, length_size = data[4] >> 4, data[4] & 15
+    base_offset_size, index_size = data[5] >> 4, data[5] & 15 if version in (1, 2) else 0
+    pos = 6
+
+    def read(n: int) -> int:
+        nonlocal pos
+        pos += n
+        return int.from_bytes(data[pos - n : pos], "big")
+
+    for _ in range(read(2 if version < 2 else 4)):
+        item_id = read(2 if version < 2 else 4)
+        construction_method = read(2) & 15 if version in (1, 2) else 0
+        read(2)  # data_reference_index
+        base_offset = read(base_offset_size)
+        extents = []
+        for _ in range(read(2)):
+            read(index_size)
+            extents.append((read(offset_size), read(length_size)))
+        if item_id != exif_id:
+            continue
+        if construction_method != 0 or not extents:
+            return None
+        offset, length = extents[0]
+        f.seek(base_offset + offset)
+        exif = f.read(min(length or 65536, 65536))
+        # the item starts with the offset to the TIFF header, usually after "Exif\0\0"
+        (tiff_offset,) = struct.unpack(">I", exif[:4])
+        return exif[4 + tiff_offset :]
+    return None
+
+
+def _quicktime_date(f: BinaryIO, size: int) -> str | None:
+    """Return media modify or create date from the mdhd or mvhd atom of a MP4/MOV file."""
+    moov = _find_box(f, 0, size, b"moov")
+    if moov is None:
+        return None
+    header = None
+    for box_type, payload, box_end in _iter_boxes(f, *moov):
+        if box_type == b"mvhd" and header is None:
+            header = payload
+        elif box_type == b"trak":
+            mdia = _find_box(f, payload, box_end, b"mdia")
+            mdhd = None if mdia is None else _find_box(f, *mdia, b"mdhd")
+            if mdhd is not None:
+                header = mdhd[0]
+                break
+    if header is None:
+        return None
+    f.seek(header)
+    data = f.read(20)
+    if data[0] == 1:
+        create_time, modify_time = struct.unpack_from(">QQ", data, 4)
+    else:
+        create_time, modify_time = struct.unpack_from(">II", data, 4)
+    # seconds since 1904-01-01, without timezone conversion as reported by exiftool
+    seconds = modify_time or create_time
+    if not seconds:
+        return None
+    return (datetime(1904, 1, 1) + timedelta(seconds=seconds)).strftime("%Y:%m:%d %H:%M:%S")
+
+
+def header_date(filename: Path) -> str | None:
+    """Return date from the first few blocks of JPEG, HEIC, MP4, and MOV files.
+
+    The date is read from the EXIF data of JPEG and HEIC files and from the headers of
+    MP4 and MOV files, without decoding images or calling exiftool.
+    """
+    ext = filename.suffix.lower()
+    try:
+        with open(filename, "rb") as f:
+            if ext in (".jpg", ".jpeg"):
+                data = _jpeg_exif(f)
+            elif ext in (".heic", ".heif"):
+                data = _heif_exif(f, os.fstat(f.fileno()).st_size)
+            else:
+                return _quicktime_date(f, os.fstat(f.fileno()).st_size)
+            return None if data is None else _tiff_date(data)
+    except (OSError, IndexError, OverflowError, ValueError, struct.error):
+        return None
+
+
+def exiftool_date(filename: Path) -> str | None:
+    metadata = get_exif_metadata([filename])[0]
+    if "QuickTime:MediaModifyDate" in metadata:
+        return str(metadata["QuickTime:MediaModifyDate"])
+    if "QuickTime:MediaCreateDate" in metadata:
+        return str(metadata["QuickTime:MediaCreateDate"])
+    if "EXIF:DateTimeOriginal" in metadata:
+        return str(metadata["EXIF:DateTimeOriginal"])
+    if "Composite:DateTimeOriginal" in metadata:
+        return str(metadata["Composite:DateTimeOriginal"])
+    return None
+
+
+class FilenameDatePatterns:
+    """Patterns of filenames with dates, matched by a single precompiled regular expression.
+
+    Each pattern is a regular expression that should match the whole filename without
+    extension, and a format string that composes a date in the format of YYYYMMDD_HHMMSS
+    from named groups of the pattern. Patterns are tried in order.
+    """
+
+    def __init__(self: "FilenameDatePatterns", patterns: Iterable[Tuple[str, str]]) -> None:
+        self.patterns = list(patterns)
+        self._compile(self.patterns)
+
+    def _compile(self: "FilenameDatePatterns", patterns: List[Tuple[str, str]]) -> None:
+        alternatives = []
+        groups = []
+        for idx, (pattern, _) in enumerate(patterns):
+            # group names have to be unique across alternatives
+            alternative = re.sub(r"\(\?P([<=])(\w+)", rf"(?P\1p{idx}_\2", pattern)
+            try:
+                names = re.compile(alternative).groupindex
+            except re.error as e:
+                raise ValueError(f"Invalid filename date pattern {pattern}: {e}") from e
+            groups.append([(x, x[len(f"p{idx}_") :]) for x in names])
+            alternatives.append(f"(?P<p{idx}>{alternative})")
+        self._regex = re.compile("|".join(alternatives))
+        self._groups = groups
+
+    def add(self: "FilenameDatePatterns", patterns: Iterable[Tuple[str, str]]) -> None:
+        """Add patterns that take priority over existing ones."""
+        new_patterns = list(patterns) + self.patterns
+        self._compile(new_patterns)
+        self.patterns = new_patterns
+
+    def match(self: "FilenameDatePatterns", stem: str) -> str | None:
+        matched = self._regex.fullmatch(stem)
+        if matched is None or matched.lastgroup is None:
+            return None
+        idx = int(matched.lastgroup[1:])
+        fields = {name: matched.group(group) or "" for group, name in self._groups[idx]}
+        return self.patterns[idx][1].format(**fields)
+
+
+filename_date_patterns = FilenameDatePatterns(
+    [
+        (
+            r"(?P<Y>\d{4})-(?P<m>\d{2})-(?P<d>\d{2})_(?P<H>\d{2})\.(?P<M>\d{2})\.(?P<S>\d{2})",
+            "{Y}{m}{d}_{H}{M}{S}",
+        ),
+        (
+            r"video-?(?P<Y>\d{4})\.(?P<m>\d{2})\.(?P<d>\d{2})_(?P<H>\d{2})-(?P<M>\d{2})-(?P<S>\d{2})",
+            "{Y}{m}{d}_{H}{M}{S}",
+        ),
+        (r"(?P<date>\d{8})[_-](?P<rest>.*)", "{date}_{rest}"),
+        (r"(?P<date>\d{8})", "{date}"),
+        (r"IMG_(?P<date>\d{8})_(?P<time>\d{6})(_\d)?", "{date}_{time}"),
+        (r"VID_(?P<date>\d{8})_(?P<time>\d{6})", "{date}_{time}"),
+        (r"PXL_(?P<date>\d{8})_(?P<time>\d{9})", "{date}_{time}"),
+        (
+            r"video-(?P<Y>\d{4})[\.-](?P<m>\d{1,2})[\.-](?P<d>\d{1,2})-(?P<rest>.+)",
+            "{Y}{m:0>2}{d:0>2}_{rest}",
+        ),
+        (
+            r"(?P<y>\d{2})[\.-](?P<m>\d{1,2})[\.-](?P<d>\d{1,2})-(?P<rest>.+)",
+            "20{y}{m:0>2}{d:0>2}_{rest}",
+        ),
+        (
+            r"(?P<Y>\d{4})-(?P<m>\d{1,2})-(?P<d>\d{1,2})-(?P<rest>.{1,3})",
+            "{Y}{m:0>2}{d:0>2}_{rest}",
+        ),
+        (r"(?P<y>\d{2})-(?P<m>\d{2})-(?P<d>\d{2})_(?P<rest>.*)", "20{y}{m}{d}_{rest}"),
+        (r"video-(?P<Y>\d{4})-(?P<m>\d{2})-(?P<d>\d{2})", "{Y}{m}{d}"),
+        (
+            r"voice-(?P<Y>\d{4})-(?P<m>\d{2})-(?P<d>\d{2})-(?P<H>\d{2})-(?P<M>\d{2})",
+            "{Y}{m}{d}_{H}{M}",
+        ),
+    ]
+)
+
+
+def filename_date(filename: Path) -> str:
+    date = filename_date_patterns.match(filename.stem)
+    if date is None:
+        raise ValueError(f"Cannot extract date from filename {filename}")
+    return date
 
 
 #
 # how to handle each file type
 #
 date_func = {
-    ".jpg": (image_date, exiftool_date, filename_date),
+    ".jpg": (header_date, image_date, exiftool_date, filename_date),
     ".png": (image_date, exiftool_date, filename_date),
-    ".jpeg": (image_date, exiftool_date, filename_date),
+    ".jpeg": (header_date, image_date, exiftool_date, filename_date),
     ".tiff": (image_date,),
     ".cr2": (filename_date, exiftool_date, image_date),
-    ".mp4": (exiftool_date, filename_date),
-    ".mov": (exiftool_date,),
-    ".3gp": (filename_date, exiftool_date),
-    ".m4a": (exiftool_date, filename_date),
+    ".mp4": (header_date, exiftool_date, filename_date),
+    ".mov": (header_date, exiftool_date),
+    ".3gp": (filename_date, header_date, exiftool_date),
+    ".m4a": (header_date, exiftool_date, filename_date),
     ".mpg": (exiftool_date, filename_date),
     ".mp3": (exiftool_date, filename_date),
     ".wmv": (exiftool_date, filename_date),
     ".wav": (exiftool_date, filename_date),
     ".avi": (exiftool_date, filename_date),
-    ".HEIC": (exiftool_date, filename_date),
+    ".heic": (header_date, exiftool_date, filename_date),
 }
 
 
 date_func.update({x.upper(): y for x, y in date_func.items()})
 
 
+def _needs_exiftool(filename: Path) -> bool:
+    """Check if the date of a file can only be retrieved by exiftool.
+
+    Dates that are retrieved otherwise are saved to the manifest so that the file is not
+    read again by MediaFile.resolve_date().
+    """
+    funcs = date_func[filename.suffix.lower()]
+    if exiftool_date not in funcs:
+        return False
+    fullname = filename.resolve()
+    try:
+        stat = fullname.stat()
+    except OSError:
+        # missing files are reported when they are planned
+        return False
+    if manifest.get_date(fullname, stat) is not None:
+        return False
+    for func in funcs[: funcs.index(exiftool_date)]:
+        try:
+            date = func(fullname)
+            if date and date.startswith("2"):
+                date = date.replace(":", "").replace(" ", "_")
+                manifest.set_date(fullname, stat, date, func.__name__)
+                return False
+        except Exception:
+            continue
+    return True
+
+
+def prefetch_exif(
+    files: Iterable[Path], batch_size: int = 200, jobs: int | None = None
+) -> Generator[Path, None, None]:
+    """Yield files after reading EXIF of files that can only be dated by exiftool.
+
+    Files are checked in parallel, and EXIF data is read with one exiftool call for each
+    batch of files and saved to the manifest, so that MediaFile.get_date() does not have
+    to read the files again or call exiftool for each file.
+    """
+
+    def prefetch(pool: ThreadPool, batch: List[Path]) -> List[Path]:
+        missing = [x for x, needed in zip(batch, pool.map(_needs_exiftool, batch)) if needed]
+        # files that fail exiftool in a batch will be processed one by one by get_date
+        if missing:
+            with suppress(Exception):
+                get_exif_metadata(missing)
+        return batch
+
+    with ThreadPool(jobs or 10) as pool:
+        batch = []
+        for filename in files:
+            batch.append(filename)
+            if len(batch) >= batch_size:
+                yield from prefetch(pool, batch)
+                batch = []
+        yield from prefetch(pool, batch)
+
+
 class MediaFile:
 
     def __init__(self: "MediaFile", filename: Path) -> None:
@@ -165,47 +419,54 @@ class MediaFile:
     @property
     def exif(self) -> Dict[str, str]:
         try:
-            with ExifToolHelper() as e:
-                return e.get_metadata([self.fullname])[0] or {}
+            return get_exif_metadata([self.fullname])[0] or {}
         except Exception:
             return {}
 
-    def get_date(
-        self: "MediaFile", confirmed: bool | None = None, logger: Logger | None = None
-    ) -> str:
+    def resolve_date(self: "MediaFile") -> str | None:
+        """Return date saved in the manifest, or retrieved from metadata or filename."""
         if self.date is None:
-            funcs = date_func[self.ext.lower()]
-            for func in funcs:
+            stat = self.fullname.stat()
+            saved = manifest.get_date(self.fullname, stat)
+            if saved is not None:
+                self.date = saved[0]
+                return self.date
+            for func in date_func[self.ext.lower()]:
                 try:
-                    self.date = func(self.fullname)
-                    if not self.date:
+                    date = func(self.fullname)
+                    if not date:
                         continue
-                    if not self.date.startswith("2"):
-                        raise ValueError(f"Invalid date {self.date}")
-                    break
+                    if not date.startswith("2"):
+                        raise ValueError(f"Invalid date {date}")
                 except Exception:
                     continue
-            if not self.date:
-                modify_time = self.fullname.stat().st_mtime
-                modify_date = datetime.fromtimestamp(modify_time)
-                formatted_date = modify_date.strftime("%Y%m%d_%H%M%S")
-                if confirmed is False:
-                    if logger is not None:
-                        logger.info(
-                            f"[green]DRYRUN[/green] Would use file modify date [blue]{formatted_date}[/blue] as file date."
-                        )
-                elif confirmed or get_response(
-                    f"Failed to retrieve datetime of {self.fullname.name}, using file modify date {formatted_date} instead?"
-                ):
-                    if logger is not None:
-                        logger.info(
-                            f"Use file modify date {formatted_date} for {self.fullname.name}"
-                        )
-                    return formatted_date
-                return "19000101_000000"
-            self.date = self.date.replace(":", "").replace(" ", "_")
+                self.date = date.replace(":", "").replace(" ", "_")
+                manifest.set_date(self.fullname, stat, self.date, func.__name__)
+                break
         return self.date
 
+    def get_date(
+        self: "MediaFile", confirmed: bool | None = None, logger: Logger | None = None
+    ) -> str:
+        date = self.resolve_date()
+        if date is not None:
+            return date
+        modify_time = self.fullname.stat().st_mtime
+        modify_date = datetime.fromtimestamp(modify_time)
+        formatted_date = modify_date.strftime("%Y%m%d_%H%M%S")
+        if confirmed is False:
+            if logger is not None:
+                logger.info(
+                    f"[green]DRYRUN[/green] Would use file modify date [blue]{formatted_date}[/blue] as file date."
+                )
+        elif confirmed or get_response(
+            f"Failed to retrieve datetime of {self.fullname.name}, using file modify date {formatted_date} instead?"
+        ):
+            if logger is not None:
+                logger.info(f"Use file modify date {formatted_date} for {self.fullname.name}")
+            return formatted_date
+        return "19000101_000000"
+
     def intended_prefix(
         self: "MediaFile",
         filename_format: str = "%Y%m%d_%H%M%S",
@@ -279,8 +540,8 @@ class MediaFile:
         shift_timedelta = timedelta(
             days=days, hours=hours, weeks=weeks, minutes=minutes, seconds=seconds
         )
-        with ExifToolHelper() as e:
-            metadata = e.get_metadata(self.fullname)[0]
+        with exiftool_pool.acquire() as e:
+            metadata = get_exif_metadata([self.fullname])[0]
             changes = {}
             for k, v in metadata.items():
                 if not k.endswith("Date") or (keys and k not in keys):
@@ -357,6 +618,8 @@ class MediaFile:
                     )
             elif confirmed or get_response(f"Shift dates of {self.fullname.name} as shown above?"):
                 e.set_tags([self.fullname], tags=changes)
+                manifest.remove_exif(self.fullname)
+                manifest.remove_date(self.fullname)
                 if logger is not None:
                     logger.info(f"EXIF data of [blue]{self.filename}[/blue] is updated.")
 
@@ -368,8 +631,8 @@ class MediaFile:
         logger: Logger | None = None,
     ) -> None:
         # add one or more 0: if the format is not YY:DD:HH:MM
-        with ExifToolHelper() as e:
-            metadata = e.get_metadata(self.fullname)[0]
+        with exiftool_pool.acquire() as e:
+            metadata = get_exif_metadata([self.fullname])[0]
             changes = {}
             for k, v in values.items():
                 if k in metadata and not override and not k.startswith("File:"):
@@ -418,6 +681,9 @@ class MediaFile:
                 if logger is not None:
                     logger.info(f"EXIF data of [blue]{self.filename}[/blue] is updated.")
                 e.set_tags([self.fullname], tags=changes, params=["-P", "-overwrite_original"])
+                # file modification time is preserved so cached exif has to be removed
+                manifest.remove_exif(self.fullname)
+                manifest.remove_date(self.fullname)
                 exif = self.exif
                 for k, v in changes.items():
                     if k not in exif or exif[k] != v:
@@ -432,166 +698,6 @@ class MediaFile:
     #     intended_path = self.intended_path(root, subdir)
     #     return self.fullname.startswith(intended_path)
 
-    def rename(
-        self: "MediaFile",
-        filename_format: str = "%Y%m%d_%H%M%S",
-        suffix: str = "",
-        confirmed: bool | None = None,
-        logger: Logger | None = None,
-        attempt: int = 0,
-    ) -> None:
-        intended_name = self.intended_name(
-            filename_format=filename_format, suffix=suffix, confirmed=confirmed, logger=logger
-        )
-        # allow the name to be xxxxxx_xxxxx-someotherstuff
-        if self.filename == intended_name:
-            return
-        elif self.filename.startswith(
-            self.intended_prefix(filename_format=filename_format, confirmed=confirmed)
-        ):
-            if logger is not None:
-                logger.info(
-                    f"File [blue]{self.filename}[/blue] already has the intended date prefix."
-                )
-            return
-
-        if attempt > 10:
-            if logger is not None:
-                logger.info("Failed to rename after 10 attempts. There must be something wrong.")
-            return
-        elif attempt > 0:
-            n, e = Path(intended_name).stem, Path(intended_name).suffix
-            nn = f"{n}_{attempt}{e}"
-        else:
-            nn = intended_name
-
-        new_file = self.dirname / nn
-
-        try:
-            if new_file.is_file():
-                if self.fullname.samefile(new_file):
-                    return
-                if filecmp.cmp(self.fullname, new_file, shallow=False):
-                    if logger is not None:
-                        logger.info(
-                            f"[green]DRYRUN[/green] Would rename {self.fullname} to an existing file {new_file}"
-                        )
-                    elif confirmed or get_response(
-                        f"Rename {self.fullname} to an existing file {new_file}"
-                    ):
-                        os.remove(self.fullname)
-                        manifest.remove(self.fullname)
-                        if logger is not None:
-                            logger.info(
-                                f"Removed duplicated file [blue]{self.fullname.name}[/blue]"
-                            )
-                    return
-                return self.rename(filename_format, suffix, confirmed, logger, attempt + 1)
-
-            if confirmed is False:
-                if logger is not None:
-                    logger.info(
-                        f"[green]DRYRUN[/green] Would rename [blue]{self.fullname}[/blue] to [green]{new_file.name}[/green]"
-                    )
-            elif confirmed or get_response(
-                f"Rename [blue]{self.fullname}[/blue] to [blue]{new_file.name}[/blue]"
-            ):
-                os.rename(self.fullname, new_file)
-                manifest.rename(self.fullname, new_file)
-                if logger is not None:
-                    logger.info(
-                        f"Renamed [blue]{self.fullname.name}[/blue] to [green]{new_file}[/green]"
-                    )
-        except Exception as e:
-            return self.rename(filename_format, suffix, confirmed, logger, attempt + 1)
-
-    def organize(
-        self: "MediaFile",
-        media_root: str,
-        dir_pattern: str,
-        album: str = "",
-        album_sep: str = "-",
-        operation: OrganizeOperation = OrganizeOperation.MOVE,
-        confirmed: bool | None = None,
-        logger: Logger | None = None,
-        attempt: int = 0,
-    ) -> None:
-        intended_path = self.intended_path(
-            media_root, dir_pattern, album, album_sep, confirmed=confirmed, logger=logger
-        )
-        if intended_path.is_relative_to(self.fullname):
-            return
-
-        if attempt > 10:
-            if logger is not None:
-                logger.info("Failed to rename after 10 attempts. There must be something wrong.")
-            return
-        elif attempt > 0:
-            n, e = Path(self.filename).stem, Path(self.filename).suffix
-            nn = f"{n}_{attempt}{e}"
-        else:
-            nn = self.filename
-
-        new_file = intended_path / nn
-
-        if confirmed is False:
-            if logger is not None:
-                logger.info(
-                    f"[green]DRYRUN[/green] Would {operation.value.capitalize()} [blue]{self.fullname}[/blue] to [blue]{intended_path}[/blue]"
-                )
-        elif confirmed or get_response(
-            f"{operation.value.capitalize()} [blue]{self.fullname}[/blue] to [blue]{intended_path}[/blue]"
-        ):
-            os.makedirs(intended_path, exist_ok=True)
-
-            try:
-                if new_file.is_file():
-                    if filecmp.cmp(self.fullname, new_file, shallow=False):
-                        if operation == OrganizeOperation.MOVE:
-                            os.remove(self.fullname)
-                            manifest.remove(self.fullname)
-                            if logger is not None:
-                                logger.info(f"Remove duplicated file {self.fullname}")
-                        else:
-                            if logger is not None:
-                                logger.info(f"Retain duplicated file {self.fullname}")
-                        return
-                    return self.organize(
-                        media_root,
-                        dir_pattern,
-                        album,
-                        album_sep,
-                        operation,
-                        confirmed,
-                        logger,
-                        attempt + 1,
-                    )
-                if operation == OrganizeOperation.COPY:
-                    shutil.copy2(self.fullname, new_file)
-                    manifest.copy(self.fullname, new_file)
-                    if logger is not None:
-                        logger.info(
-                            f"Copied [blue]{self.fullname.name}[/blue] to [green]{new_file}[/green]"
-                        )
-                else:
-                    shutil.move(self.fullname, new_file)
-                    manifest.rename(self.fullname, new_file)
-                    if logger is not None:
-                        logger.info(
-                            f"Moved [blue]{self.fullname.name}[/blue] to [green]{new_file}[/green]"
-                        )
-            except Exception as e:
-                return self.organize(
-                    media_root,
-                    dir_pattern,
-                    album,
-                    album_sep,
-                    operation,
-                    confirmed,
-                    logger,
-                    attempt + 1,
-                )
-
     def set_tags(
         self: "MediaFile",
         tags: Dict[str, Any],
@@ -1,32 +1,74 @@
 import argparse
 import logging
+from functools import partial
+from pathlib import Path
 
 from .home_media_organizer import iter_files
-from .media_file import MediaFile
-from .utils import OrganizeOperation
+from .media_file import prefetch_exif
+from .plan import Journal, Planner, add_plan_arguments, apply_plan, read_plan, write_plan
+from .utils import OrganizeOperation, manifest
 
 
 #
 # organize files
 #
 def organize_files(args: argparse.Namespace, logger: logging.Logger | None) -> None:
+    if args.resume or args.apply:
+        if args.resume:
+            journal = Journal.resume("organize", args.confirmed, logger)
+            if journal is None:
+                return
+            items = journal.items
+        else:
+            journal = Journal.start("organize") if args.confirmed is not False else None
+            items = read_plan(args.apply, args.items)
+        with manifest.batch():
+            apply_plan(
+                items,
+                args.confirmed,
+                logger,
+                args.jobs,
+                verify=args.verify,
+                journal=journal,
+                paranoid=args.paranoid,
+            )
+        return
+
     for option in ("media_root", "dir_pattern"):
         if not getattr(args, option):
             raise ValueError(
                 f"Option --{option} is required. Please specify them either from command line or in your configuration file."
             )
 
-    for item in iter_files(args):
-        m = MediaFile(item)
-        m.organize(
-            media_root=args.media_root,
+    planner = Planner(
+        confirmed=args.confirmed, logger=logger, jobs=args.jobs, paranoid=args.paranoid
+    )
+    planned = planner.plan(
+        prefetch_exif(iter_files(args), jobs=args.jobs),
+        partial(
+            planner.plan_organize,
+            media_root=Path(args.media_root).resolve(),
             dir_pattern=args.dir_pattern,
-            album=args.album,
+            album=args.album or "",
             album_sep=args.album_sep,
             operation=OrganizeOperation(args.operation),
-            confirmed=args.confirmed,
-            logger=logger,
-        )
+        ),
+    )
+    with manifest.batch():
+        if args.plan:
+            cnt = write_plan(planned, args.plan)
+            if logger is not None:
+                logger.info(f"[blue]{cnt}[/blue] operations are saved to {args.plan}")
+        else:
+            apply_plan(
+                planned,
+                args.confirmed,
+                logger,
+                args.jobs,
+                verify=args.verify,
+                journal=Journal.start("organize") if args.confirmed is not False else None,
+                paranoid=args.paranoid,
+            )
 
 
 def get_organize_parser(subparsers: argparse._SubParsersAction) -> argparse.ArgumentParser:
@@ -60,5 +102,13 @@ def get_organize_parser(subparsers: argparse._SubParsersAction) -> argparse.Argu
         choices=[x.value for x in OrganizeOperation],
         help="How to organize the files. By default, files will be moved.",
     )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="""Read copied files again from disk and compare them to the original files.
+            Files are hashed while being copied so that their signatures are saved without
+            reading them again.""",
+    )
+    add_plan_arguments(parser)
     parser.set_defaults(func=organize_files, command="organize")
     return parser
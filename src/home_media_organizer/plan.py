@@ -0,0 +1,611 @@
+import argparse
+import filecmp
+import json
+import os
+import threading
+from dataclasses import dataclass
+from enum import Enum
+from logging import Logger
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+from queue import Queue
+from typing import Callable, Dict, Generator, Iterable, List, Set
+
+from .home_media_organizer import PathIndex, Worker
+from .media_file import MediaFile
+from .utils import (
+    OrganizeOperation,
+    copy_file,
+    get_file_hash,
+    get_response,
+    manifest,
+    move_file,
+)
+
+
+class PlanAction(Enum):
+    RENAME = "rename"
+    MOVE = "move"
+    COPY = "copy"
+    # remove source because target is a duplicate
+    REMOVE = "remove"
+    # keep source although target is a duplicate
+    RETAIN = "retain"
+
+
+@dataclass
+class PlanItem:
+    action: PlanAction
+    source: Path
+    target: Path
+
+    def to_json(self: "PlanItem") -> str:
+        return json.dumps(
+            {"action": self.action.value, "source": str(self.source), "target": str(self.target)}
+        )
+
+    @classmethod
+    def from_json(cls: type["PlanItem"], line: str) -> "PlanItem":
+        data = json.loads(line)
+        return cls(PlanAction(data["action"]), Path(data["source"]), Path(data["target"]))
+
+
+def same_content(source: Path, target: Path, paranoid: bool = False) -> bool:
+    """Compare sizes and then cached signatures, so each file is read at most once.
+
+    Files are compared byte by byte only if their signatures match and paranoid is set.
+    """
+    if source.stat().st_size != target.stat().st_size:
+        return False
+    if get_file_hash(source) != get_file_hash(target):
+        return False
+    return not paranoid or filecmp.cmp(source, target, shallow=False)
+
+
+class Planner:
+    """Plan the rename or move of media files without changing any file.
+
+    Dates of files are resolved in parallel. Each target directory is listed once, and
+    targets of planned items are tracked in memory, so collisions are detected without
+    probing the file system for each candidate name.
+    """
+
+    max_attempts = 10
+
+    def __init__(
+        self: "Planner",
+        confirmed: bool | None = None,
+        logger: Logger | None = None,
+        jobs: int | None = None,
+        paranoid: bool = False,
+    ) -> None:
+        self.confirmed = confirmed
+        self.logger = logger
+        self.jobs = jobs
+        self.paranoid = paranoid
+        self._listings: Dict[Path, Set[str]] = {}
+        # targets of planned items and their sources
+        self._claimed: Dict[Path, Path] = {}
+        # sources that will be moved or removed by planned items
+        self._vacated: Set[Path] = set()
+
+    def _listing(self: "Planner", directory: Path) -> Set[str]:
+        if directory not in self._listings:
+            try:
+                names = set(os.listdir(directory))
+            except (FileNotFoundError, NotADirectoryError):
+                names = set()
+            self._listings[directory] = names - {
+                x.name for x in self._vacated if x.parent == directory
+            }
+        return self._listings[directory]
+
+    def _occupant(self: "Planner", target: Path) -> Path | None:
+        """Return the file that will be at target when all planned items are applied."""
+        if target in self._claimed:
+            return self._claimed[target]
+        return target if target.name in self._listing(target.parent) else None
+
+    def _claim(self: "Planner", item: PlanItem) -> PlanItem:
+        if item.action in (PlanAction.RENAME, PlanAction.MOVE, PlanAction.REMOVE):
+            self._vacated.add(item.source)
+            self._listings.get(item.source.parent, set()).discard(item.source.name)
+        if item.action in (PlanAction.RENAME, PlanAction.MOVE, PlanAction.COPY):
+            self._claimed[item.target] = item.source
+        return item
+
+    def _same_content(self: "Planner", source: Path, occupant: Path, target: Path) -> bool:
+        # occupant might have been moved to target if planned items are being applied
+        for filename in (occupant, target):
+            try:
+                return same_content(source, filename, self.paranoid)
+            except FileNotFoundError:
+                continue
+            except OSError:
+                return False
+        return False
+
+    def _failed(self: "Planner", m: MediaFile) -> None:
+        if self.logger is not None:
+            self.logger.info(
+                f"Failed to find a name for {m.fullname} after {self.max_attempts} attempts. There must be something wrong."
+            )
+
+    def plan(
+        self: "Planner",
+        files: Iterable[Path],
+        plan_file: Callable[[MediaFile], PlanItem | None],
+    ) -> Generator[PlanItem, None, None]:
+        """Resolve dates of files in parallel and yield planned items in the order of files."""
+
+        def resolve_date(m: MediaFile) -> MediaFile:
+            try:
+                m.resolve_date()
+            except OSError:
+                pass
+            return m
+
+        with ThreadPool(self.jobs or 10) as pool:
+            for m in pool.imap(resolve_date, (MediaFile(x) for x in files), chunksize=16):
+                # prompt for files without date, and remember the answer
+                try:
+                    m.date = m.get_date(confirmed=self.confirmed, logger=self.logger)
+                except OSError as e:
+                    if self.logger is not None:
+                        self.logger.error(f"[red]Failed to process {m.fullname}: {e}[/red]")
+                    continue
+                item = plan_file(m)
+                if item is not None:
+                    yield item
+
+    def plan_rename(
+        self: "Planner", m: MediaFile, filename_format: str = "%Y%m%d_%H%M%S", suffix: str = ""
+    ) -> PlanItem | None:
+        intended_name = m.intended_name(filename_format=filename_format, suffix=suffix)
+        # allow the name to be xxxxxx_xxxxx-someotherstuff
+        if m.filename == intended_name:
+            return None
+        if m.filename.startswith(m.intended_prefix(filename_format=filename_format)):
+            if self.logger is not None:
+                self.logger.info(
+                    f"File [blue]{m.filename}[/blue] already has the intended date prefix."
+                )
+            return None
+
+        stem, ext = Path(intended_name).stem, Path(intended_name).suffix
+        for attempt in range(self.max_attempts + 1):
+            target = m.fullname.parent / (
+                intended_name if attempt == 0 else f"{stem}_{attempt}{ext}"
+            )
+            occupant = self._occupant(target)
+            if occupant is None:
+                return self._claim(PlanItem(PlanAction.RENAME, m.fullname, target))
+            if occupant == m.fullname:
+                return None
+            if self._same_content(m.fullname, occupant, target):
+                return self._claim(PlanItem(PlanAction.REMOVE, m.fullname, target))
+        self._failed(m)
+        return None
+
+    def plan_organize(
+        self: "Planner",
+        m: MediaFile,
+        media_root: Path,
+        dir_pattern: str,
+        album: str = "",
+        album_sep: str = "-",
+        operation: OrganizeOperation = OrganizeOperation.MOVE,
+    ) -> PlanItem | None:
+        intended_path = m.intended_path(str(media_root), dir_pattern, album, album_sep)
+        # file without valid date, or already in place
+        if intended_path == m.dirname or intended_path == m.fullname.parent:
+            return None
+
+        if operation == OrganizeOperation.COPY:
+            action, duplicate_action = PlanAction.COPY, PlanAction.RETAIN
+        else:
+            action, duplicate_action = PlanAction.MOVE, PlanAction.REMOVE
+        stem, ext = Path(m.filename).stem, Path(m.filename).suffix
+        for attempt in range(self.max_attempts + 1):
+            target = intended_path / (m.filename if attempt == 0 else f"{stem}_{attempt}{ext}")
+            occupant = self._occupant(target)
+            if occupant is None:
+                return self._claim(PlanItem(action, m.fullname, target))
+            if occupant == m.fullname:
+                return None
+            if self._same_content(m.fullname, occupant, target):
+                return self._claim(PlanItem(duplicate_action, m.fullname, target))
+        self._failed(m)
+        return None
+
+
+class DirectoryCache:
+    """Directories and their content as known to a run that applies a plan.
+
+    Each directory is listed or created once, and its listing is updated as files are
+    added or removed, so that existence checks do not touch the file system, which is
+    slow on network file systems.
+    """
+
+    def __init__(self: "DirectoryCache") -> None:
+        self._lock = threading.Lock()
+        # None for directories that do not exist
+        self._listings: Dict[Path, Set[str] | None] = {}
+
+    def _listing(self: "DirectoryCache", directory: Path) -> Set[str] | None:
+        if directory not in self._listings:
+            try:
+                self._listings[directory] = set(os.listdir(directory))
+            except (FileNotFoundError, NotADirectoryError):
+                self._listings[directory] = None
+        return self._listings[directory]
+
+    def exists(self: "DirectoryCache", filename: Path) -> bool:
+        with self._lock:
+            names = self._listing(filename.parent)
+            return names is not None and filename.name in names
+
+    def makedirs(self: "DirectoryCache", directory: Path) -> None:
+        with self._lock:
+            if self._listing(directory) is not None:
+                return
+            os.makedirs(directory, exist_ok=True)
+            self._listings[directory] = set()
+            # parent directories might have been created as well
+            for parent in directory.parents:
+                if parent in self._listings and self._listings[parent] is None:
+                    self._listings.pop(parent)
+
+    def add(self: "DirectoryCache", filename: Path) -> None:
+        with self._lock:
+            names = self._listings.get(filename.parent)
+            if names is not None:
+                names.add(filename.name)
+
+    def discard(self: "DirectoryCache", filename: Path) -> None:
+        with self._lock:
+            names = self._listings.get(filename.parent)
+            if names is not None:
+                names.discard(filename.name)
+
+
+class Journal:
+    """Planned and completed items of a run, saved in the manifest database.
+
+    Planned items are committed before they are applied so that an interrupted run can
+    be resumed without planning again. Items that were applied but not yet recorded as
+    completed, such as a move across file systems that was interrupted after the copy,
+    are detected from the file system and rolled forward when the run is resumed.
+    """
+
+    def __init__(self: "Journal", run_id: int, items: List[PlanItem] | None = None) -> None:
+        self.run_id = run_id
+        # pending items of a resumed run, which are already recorded
+        self.items = items or []
+        self._recorded = {x.source for x in self.items}
+
+    @classmethod
+    def start(cls: type["Journal"], command: str) -> "Journal":
+        return cls(manifest.start_run(command))
+
+    @classmethod
+    def resume(
+        cls: type["Journal"],
+        command: str,
+        confirmed: bool | None = None,
+        logger: Logger | None = None,
+    ) -> "Journal | None":
+        run_id = manifest.find_run(command)
+        if run_id is None:
+            if logger is not None:
+                logger.info(f"No interrupted run of [blue]{command}[/blue] is found.")
+            return None
+        journal = cls(run_id)
+        for action, source, target, done in manifest.get_journal_items(run_id):
+            if done:
+                continue
+            item = PlanItem(PlanAction(action), Path(source), Path(target))
+            if not journal._roll_forward(item, confirmed, logger):
+                journal.items.append(item)
+        journal._recorded = {x.source for x in journal.items}
+        if logger is not None:
+            logger.info(f"Resuming [blue]{len(journal.items)}[/blue] pending operations.")
+        return journal
+
+    def _roll_forward(
+        self: "Journal", item: PlanItem, confirmed: bool | None, logger: Logger | None
+    ) -> bool:
+        """Complete an item that was applied, fully or partially, by the interrupted run."""
+        if item.action == PlanAction.RETAIN:
+            return False
+        if item.action == PlanAction.REMOVE:
+            if item.source.exists():
+                return False
+            if confirmed is not False:
+                manifest.remove(item.source)
+        elif not item.target.exists():
+            return False
+        elif not item.source.exists():
+            if item.action == PlanAction.COPY:
+                return False
+            if confirmed is not False:
+                manifest.rename(item.source, item.target)
+        elif item.action == PlanAction.RENAME:
+            return False
+        else:
+            # a copy is complete if it has the same content as its source, otherwise the
+            # item is skipped because target exists
+            try:
+                same = same_content(item.source, item.target)
+            except OSError:
+                same = False
+            if not same:
+                if logger is not None:
+                    logger.warning(
+                        f"[red]{item.target} differs from {item.source}, and might be a partial copy of an interrupted run.[/red]"
+                    )
+                return False
+            if item.action == PlanAction.COPY:
+                if confirmed is not False:
+                    manifest.copy(item.source, item.target)
+            elif confirmed is False:
+                if logger is not None:
+                    logger.info(
+                        f"[green]DRYRUN[/green] Would remove [blue]{item.source}[/blue], which is moved to [blue]{item.target}[/blue]"
+                    )
+                return True
+            else:
+                os.remove(item.source)
+                manifest.rename(item.source, item.target)
+        if confirmed is not False:
+            self.complete(item)
+        if logger is not None:
+            logger.info(f"Completed interrupted {item.action.value} of [blue]{item.source}[/blue]")
+        return True
+
+    def record(
+        self: "Journal", items: Iterable[PlanItem], chunk_size: int = 100
+    ) -> Generator[PlanItem, None, None]:
+        """Record items in chunks before yielding them to be applied."""
+        chunk: List[PlanItem] = []
+        for item in items:
+            if item.source in self._recorded:
+                yield item
+                continue
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                yield from self._record(chunk)
+                chunk = []
+        yield from self._record(chunk)
+
+    def _record(self: "Journal", items: List[PlanItem]) -> List[PlanItem]:
+        if items:
+            manifest.add_journal_items(
+                self.run_id, [(x.action.value, str(x.source), str(x.target)) for x in items]
+            )
+        return items
+
+    def complete(self: "Journal", item: PlanItem) -> None:
+        manifest.complete_journal_item(self.run_id, str(item.source))
+
+    def finish(self: "Journal") -> None:
+        manifest.finish_run(self.run_id)
+
+
+def write_plan(items: Iterable[PlanItem], filename: str) -> int:
+    cnt = 0
+    with open(filename, "w") as plan:
+        for item in items:
+            plan.write(item.to_json() + "\n")
+            cnt += 1
+    return cnt
+
+
+def read_plan(filename: str, paths: List[str] | None = None) -> List[PlanItem]:
+    """Read items of a plan, optionally only those with sources under specified paths."""
+    with open(filename) as plan:
+        items = [PlanItem.from_json(line) for line in plan if line.strip()]
+    if paths is None:
+        return items
+    sources = PathIndex(str(x.source) for x in items)
+    selected: Set[str] = set()
+    for path in paths:
+        path = str(Path(path).resolve())
+        if path in sources:
+            selected.add(path)
+        else:
+            selected |= set(sources.files_under(path))
+    return [x for x in items if str(x.source) in selected]
+
+
+def apply_plan_item(
+    item: PlanItem,
+    confirmed: bool | None = None,
+    logger: Logger | None = None,
+    verify: bool = False,
+    directories: DirectoryCache | None = None,
+    paranoid: bool = False,
+) -> bool:
+    """Apply an item of a plan, and return True if the item is completed.
+
+    A source is removed only if it still has the same content as its target.
+    """
+    if item.action == PlanAction.RETAIN:
+        if logger is not None:
+            logger.info(f"Retain duplicated file {item.source}")
+        return True
+
+    if item.action == PlanAction.REMOVE:
+        message = f"remove [blue]{item.source}[/blue], which is a duplicate of [blue]{item.target}[/blue]"
+    elif item.action == PlanAction.RENAME:
+        message = f"rename [blue]{item.source}[/blue] to [green]{item.target.name}[/green]"
+    else:
+        message = (
+            f"{item.action.value} [blue]{item.source}[/blue] to [blue]{item.target.parent}[/blue]"
+        )
+    if confirmed is False:
+        if logger is not None:
+            logger.info(f"[green]DRYRUN[/green] Would {message}")
+        return False
+    if not confirmed and not get_response(message[0].upper() + message[1:]):
+        return False
+
+    if directories is None:
+        directories = DirectoryCache()
+    try:
+        if item.action == PlanAction.REMOVE:
+            if not directories.exists(item.target):
+                if logger is not None:
+                    logger.warning(
+                        f"[red]Keep {item.source} because {item.target} no longer exists.[/red]"
+                    )
+                return False
+            # the plan might be outdated or edited
+            if not same_content(item.source, item.target, paranoid):
+                if logger is not None:
+                    logger.warning(
+                        f"[red]Keep {item.source} because it differs from {item.target}.[/red]"
+                    )
+                return False
+            os.remove(item.source)
+            directories.discard(item.source)
+            manifest.remove(item.source)
+            if logger is not None:
+                logger.info(f"Removed duplicated file [blue]{item.source}[/blue]")
+            return True
+        # the plan might be outdated
+        if directories.exists(item.target):
+            if logger is not None:
+                logger.warning(
+                    f"[red]Skip {item.source} because {item.target} already exists.[/red]"
+                )
+            return False
+        if item.action == PlanAction.RENAME:
+            os.rename(item.source, item.target)
+            directories.discard(item.source)
+            directories.add(item.target)
+            manifest.rename(item.source, item.target)
+            if logger is not None:
+                logger.info(
+                    f"Renamed [blue]{item.source.name}[/blue] to [green]{item.target}[/green]"
+                )
+        elif item.action == PlanAction.COPY:
+            directories.makedirs(item.target.parent)
+            # hash the content while copying unless it is already known, or not read at all
+            result = copy_file(
+                item.source,
+                item.target,
+                hash_content=manifest.get_signature(item.source.stat()) is None,
+                verify=verify,
+                logger=logger,
+            )
+            directories.add(item.target)
+            manifest.copy(item.source, item.target)
+            if result.source_stat is not None:
+                signature = result.signature or manifest.get_signature(result.source_stat)
+                if signature is not None:
+                    manifest.set_hash(item.target, signature)
+                    manifest.set_signature(item.target.stat(), signature)
+                    manifest.set_signature(result.source_stat, signature)
+            if logger is not None:
+                logger.info(
+                    f"Copied [blue]{item.source.name}[/blue] to [green]{item.target}[/green] ({result.method})"
+                )
+        else:
+            directories.makedirs(item.target.parent)
+            method = move_file(item.source, item.target, logger=logger)
+            directories.discard(item.source)
+            directories.add(item.target)
+            manifest.rename(item.source, item.target)
+            if logger is not None:
+                logger.info(
+                    f"Moved [blue]{item.source.name}[/blue] to [green]{item.target}[/green] ({method})"
+                )
+        return True
+    except OSError as e:
+        if logger is not None:
+            logger.error(f"[red]Failed to {item.action.value} {item.source}: {e}[/red]")
+        return False
+
+
+def apply_plan(
+    items: Iterable[PlanItem],
+    confirmed: bool | None = None,
+    logger: Logger | None = None,
+    jobs: int | None = None,
+    verify: bool = False,
+    journal: Journal | None = None,
+    paranoid: bool = False,
+) -> None:
+    """Apply items of a plan, in parallel across target directories if confirmed is True.
+
+    Items with the same target directory are applied in order by the same worker, so that
+    files are named as planned. Items that take the name of a file that is moved out by an
+    earlier item, or that remove a duplicate of a file placed by an earlier item, are
+    applied after that item by the same worker.
+    """
+    num_workers = jobs or 10
+    directories = DirectoryCache()
+    if journal is not None and confirmed is not False:
+        items = journal.record(items)
+
+    def apply(item: PlanItem) -> None:
+        try:
+            completed = apply_plan_item(item, confirmed, logger, verify, directories, paranoid)
+            if completed and journal is not None:
+                journal.complete(item)
+        except Exception as e:
+            if logger is not None:
+                logger.error(f"[red]Failed to {item.action.value} {item.source}: {e}[/red]")
+
+    if confirmed is not True or num_workers == 1:
+        # prompts and dryrun messages are not interleaved
+        for item in items:
+            apply(item)
+    else:
+        queues: List[Queue[PlanItem | None]] = [Queue() for _ in range(num_workers)]
+        workers = [Worker(q, apply) for q in queues]
+        for worker in workers:
+            worker.start()
+        # workers of items that vacated or claimed a path, in the order of items
+        workers_of_paths: Dict[Path, int] = {}
+        for item in items:
+            idx = workers_of_paths.get(
+                item.target,
+                workers_of_paths.get(item.source, hash(item.target.parent) % num_workers),
+            )
+            workers_of_paths[item.source] = workers_of_paths[item.target] = idx
+            queues[idx].put(item)
+        for q in queues:
+            q.put(None)
+        for worker in workers:
+            worker.join()
+    if journal is not None and confirmed is not False:
+        journal.finish()
+
+
+def add_plan_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--plan",
+        help="""Save planned operations to a file in JSON lines format, without changing
+            any file. The plan can be reviewed, edited, and executed with option --apply.""",
+    )
+    group.add_argument(
+        "--resume",
+        action="store_true",
+        help="""Resume the last interrupted run of the command, which completes operations
+            that were interrupted and applies pending ones, without recomputing dates and
+            names of files.""",
+    )
+    group.add_argument(
+        "--apply",
+        help="""Execute operations saved by option --plan, for files under specified items,
+            without recomputing dates and names of files.""",
+    )
+    parser.add_argument(
+        "--paranoid",
+        action="store_true",
+        help="""Compare files byte by byte, in addition to their signatures, before treating
+            a file as a duplicate of an existing file with the intended name.""",
+    )
@@ -1,41 +1,56 @@
 import argparse
 import logging
-from pathlib import Path
+from functools import partial
 
-from .home_media_organizer import iter_files, process_with_queue
-from .media_file import MediaFile
+from .home_media_organizer import iter_files
+from .media_file import prefetch_exif
+from .plan import Journal, Planner, add_plan_arguments, apply_plan, read_plan, write_plan
+from .utils import manifest
 
 
 #
 # rename file to its canonical name
 #
-def rename_file(
-    item: Path,
-    filename_format: str,
-    suffix: str,
-    confirmed: bool | None,
-    logger: logging.Logger | None,
-) -> None:
-    m = MediaFile(item)
-    # logger.info(f"Processing [blue]{item}[/blue]")
-    m.rename(filename_format=filename_format, suffix=suffix, confirmed=confirmed, logger=logger)
-
-
 def rename_files(args: argparse.Namespace, logger: logging.Logger | None) -> None:
+    if args.resume or args.apply:
+        if args.resume:
+            journal = Journal.resume("rename", args.confirmed, logger)
+            if journal is None:
+                return
+            items = journal.items
+        else:
+            journal = Journal.start("rename") if args.confirmed is not False else None
+            items = read_plan(args.apply, args.items)
+        with manifest.batch():
+            apply_plan(
+                items, args.confirmed, logger, args.jobs, journal=journal, paranoid=args.paranoid
+            )
+        return
+
     if not args.format:
         raise ValueError("Option --format is required.")
-    if args.confirmed is not None:
-        process_with_queue(
-            args,
-            lambda x, filename_format=args.format, suffix=args.suffix or "", logger=logger: rename_file(
-                x, filename_format, suffix, True, logger
-            ),
-        )
-    else:
-        for item in iter_files(args):
+
+    planner = Planner(
+        confirmed=args.confirmed, logger=logger, jobs=args.jobs, paranoid=args.paranoid
+    )
+    planned = planner.plan(
+        prefetch_exif(iter_files(args), jobs=args.jobs),
+        partial(planner.plan_rename, filename_format=args.format, suffix=args.suffix or ""),
+    )
+    with manifest.batch():
+        if args.plan:
+            cnt = write_plan(planned, args.plan)
             if logger is not None:
-                logger.info(f"Processing [blue]{item}[/blue]")
-            rename_file(item, args.format, args.suffix or "", args.confirmed, logger)
+                logger.info(f"[blue]{cnt}[/blue] operations are saved to {args.plan}")
+        else:
+            apply_plan(
+                planned,
+                args.confirmed,
+                logger,
+                args.jobs,
+                journal=Journal.start("rename") if args.confirmed is not False else None,
+                paranoid=args.paranoid,
+            )
 
 
 def get_rename_parser(subparsers: argparse._SubParsersAction) -> argparse.ArgumentParser:
@@ -53,5 +68,6 @@ def get_rename_parser(subparsers: argparse._SubParsersAction) -> argparse.Argume
         "--suffix",
         help="A string that will be appended to filename (before file extension).",
     )
+    add_plan_arguments(parser)
     parser.set_defaults(func=rename_files, command="rename")
     return parser
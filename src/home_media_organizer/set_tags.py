@@ -10,6 +10,7 @@ from tqdm import tqdm  # type: ignore
 
 from .home_media_organizer import iter_files
 from .media_file import MediaFile
+from .utils import manifest
 
 #
 # set tags to media files
@@ -50,7 +51,7 @@ def set_tags(args: argparse.Namespace, logger: logging.Logger | None) -> None:
     tags = {x: metadata for x in args.tags}
 
     if args.confirmed is not None:
-        with Pool(args.jobs or None) as pool:
+        with Pool(args.jobs or None) as pool, manifest.batch():
             for item, match in tqdm(
                 pool.imap(
                     verify_files,
@@ -76,22 +77,23 @@ def set_tags(args: argparse.Namespace, logger: logging.Logger | None) -> None:
                 cnt += 1
     else:
         # do the samething sequentially
-        for item in tqdm(iter_files(args)):
-            match = verify_files(
-                (
-                    item,
+        with manifest.batch():
+            for item in tqdm(iter_files(args)):
+                match = verify_files(
                     (
-                        tuple(cast(List[str], args.if_similar_to))
-                        if args.if_similar_to is not None
-                        else None
-                    ),
-                    float(args.threshold),
-                    logger,
-                )
-            )[1]
-            if match:
-                MediaFile(item).set_tags(tags, args.overwrite, args.confirmed, logger)
-                cnt += 1
+                        item,
+                        (
+                            tuple(cast(List[str], args.if_similar_to))
+                            if args.if_similar_to is not None
+                            else None
+                        ),
+                        float(args.threshold),
+                        logger,
+                    )
+                )[1]
+                if match:
+                    MediaFile(item).set_tags(tags, args.overwrite, args.confirmed, logger)
+                    cnt += 1
     if logger is not None:
         logger.info(f"[blue]{cnt}[/blue] files tagged.")
 
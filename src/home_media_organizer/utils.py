@@ -1,15 +1,22 @@
+import atexit
+import errno
 import hashlib
 import json
+import os
+import shutil
 import sqlite3
-from contextlib import contextmanager
+import threading
+import zlib
+from contextlib import contextmanager, suppress
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
 from logging import Logger
 from pathlib import Path
-from typing import Any, Dict, Generator, List
+from typing import Any, Dict, Generator, Iterable, List, Set, Tuple
 
 from diskcache import Cache  # type: ignore
+from exiftool import ExifToolHelper  # type: ignore
 from pyparsing import (
     CharsNotIn,
     Keyword,
@@ -43,9 +50,38 @@ def get_response(msg: str) -> bool:
     return Prompt.ask(msg, choices=["y", "n"], default="y") == "y"
 
 
-@cache.memoize(tag="signature")
-def get_file_hash(file_path: Path) -> str:
-    return calculate_file_hash(file_path)
+def get_file_hash(file_path: Path, refresh: bool = False, save: bool = True) -> str:
+    """Return the content signature of a file, re-hashing only if the file has changed.
+
+    Signatures are cached in the manifest database and keyed by device, inode, size and
+    modification time so that edited or replaced files are detected by a single stat call.
+    Newly calculated signatures are not saved if save is False, which is needed for worker
+    processes if the main process writes to the manifest in batch mode.
+    """
+    stat = file_path.stat()
+    if not refresh:
+        signature = manifest.get_signature(stat)
+        if signature is not None:
+            return signature
+    signature = calculate_file_hash(file_path)
+    if save:
+        manifest.set_signature(stat, signature)
+    return signature
+
+
+def get_exif_metadata(files: List[Path], refresh: bool = False) -> List[Dict[str, Any]]:
+    """Return exiftool output of files, calling exiftool only for files that have changed."""
+    # output is cached by resolved names of files, which are also used to invalidate it
+    fullnames = [x.resolve() for x in files]
+    stats = [os.stat(x) for x in fullnames]
+    cached = [None if refresh else manifest.get_exif(x, stat) for x, stat in zip(fullnames, stats)]
+    missing = [i for i, x in enumerate(cached) if x is None]
+    fetched: Dict[int, Dict[str, Any]] = {}
+    if missing:
+        with exiftool_pool.acquire() as e:
+            fetched = dict(zip(missing, e.get_metadata([files[i] for i in missing])))
+        manifest.set_exif_many((fullnames[i], stats[i], x) for i, x in fetched.items())
+    return [fetched[i] if x is None else x for i, x in enumerate(cached)]
 
 
 def calculate_file_hash(file_path: Path) -> str:
@@ -57,6 +93,168 @@ def calculate_file_hash(file_path: Path) -> str:
     return sha_hash.hexdigest()
 
 
+def drop_file_cache(file_path: Path) -> None:
+    """Write a file to disk and drop it from the page cache, if supported by the system."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+# ioctl request that shares the extents of a file with another one on btrfs, XFS etc.
+FICLONE = 0x40049409
+
+
+@dataclass
+class CopyResult:
+    # reflink, copy_file_range, sendfile, or copy_buffer
+    method: str
+    # signature of the content if it was read during the copy
+    signature: str | None
+    # stat of the source, or None if the source was changed while being copied
+    source_stat: os.stat_result | None
+
+
+def _reflink(src: int, dst: int, size: int, sha_hash: Any) -> None:
+    import fcntl
+
+    fcntl.ioctl(dst, FICLONE, src)
+
+
+def _copy_file_range(src: int, dst: int, size: int, sha_hash: Any) -> None:
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(src, dst, size - offset, offset, offset)
+        if copied == 0:
+            # try the next method instead of accepting a short copy
+            raise OSError(f"Copied only {offset} of {size} bytes")
+        offset += copied
+
+
+def _sendfile(src: int, dst: int, size: int, sha_hash: Any) -> None:
+    offset = 0
+    while offset < size:
+        copied = os.sendfile(dst, src, offset, min(size - offset, 1 << 30))
+        if copied == 0:
+            # try the next method instead of accepting a short copy
+            raise OSError(f"Copied only {offset} of {size} bytes")
+        offset += copied
+
+
+def _copy_buffer(src: int, dst: int, size: int, sha_hash: Any, buffer_size: int = 8 << 20) -> None:
+    with os.fdopen(src, "rb", closefd=False) as fsrc, os.fdopen(dst, "wb", closefd=False) as fdst:
+        while chunk := fsrc.read(buffer_size):
+            if sha_hash is not None:
+                sha_hash.update(chunk)
+            fdst.write(chunk)
+
+
+def copy_file(
+    source: Path,
+    target: Path,
+    hash_content: bool = False,
+    verify: bool = False,
+    logger: Logger | None = None,
+) -> CopyResult:
+    """Copy a file and its metadata as shutil.copy2 does, with the fastest available method.
+
+    The content is cloned if the file system supports reflinks, copied in the kernel with
+    copy_file_range or sendfile if possible, and copied through a large buffer otherwise.
+    Target is never overwritten, and partial copies are removed on failure.
+
+    :param hash_content: Calculate the signature of the content if it has to be read,
+        namely when it cannot be cloned.
+    :param verify: Read target again from disk and compare its signature to the source.
+    """
+    methods = [_reflink]
+    if not hash_content:
+        if hasattr(os, "copy_file_range"):
+            methods.append(_copy_file_range)
+        if hasattr(os, "sendfile"):
+            methods.append(_sendfile)
+    methods.append(_copy_buffer)
+
+    with open(source, "rb") as src:
+        stat = os.fstat(src.fileno())
+        # fail if target exists, which should never be overwritten
+        dst = open(target, "xb")
+        try:
+            with dst:
+                for method in methods:
+                    sha_hash = hashlib.sha256() if hash_content else None
+                    try:
+                        method(src.fileno(), dst.fileno(), stat.st_size, sha_hash)
+                        break
+                    except (OSError, ImportError) as e:
+                        if method is _copy_buffer or getattr(e, "errno", None) == errno.ENOSPC:
+                            raise
+                        # not supported by the system or file system, start over
+                        os.ftruncate(dst.fileno(), 0)
+                        os.lseek(dst.fileno(), 0, os.SEEK_SET)
+                        if logger is not None:
+                            logger.debug(
+                                f"Failed to copy {source} with {method.__name__[1:]}: {e}"
+                            )
+            new_stat = os.fstat(src.fileno())
+            shutil.copystat(source, target)
+            signature = None if sha_hash is None or method is _reflink else sha_hash.hexdigest()
+            if verify:
+                if signature is None:
+                    signature = calculate_file_hash(source)
+                drop_file_cache(target)
+                if calculate_file_hash(target) != signature:
+                    raise OSError(f"Content of {target} differs from {source} after copy")
+        except BaseException:
+            # do not leave a partial or corrupted copy
+            target.unlink(missing_ok=True)
+            raise
+    if logger is not None:
+        logger.debug(f"Copied {source} to {target} with {method.__name__[1:]}")
+    unchanged = (stat.st_size, stat.st_mtime_ns) == (new_stat.st_size, new_stat.st_mtime_ns)
+    return CopyResult(method.__name__[1:], signature, stat if unchanged else None)
+
+
+def move_file(source: Path, target: Path, logger: Logger | None = None) -> str:
+    """Move a file by renaming it, or by copying and removing it across file systems.
+
+    :return: The method used, namely rename, or one of the methods used by copy_file.
+    """
+    try:
+        os.rename(source, target)
+        return "rename"
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    method = copy_file(source, target, logger=logger).method
+    if target.stat().st_size != source.stat().st_size:
+        target.unlink()
+        raise OSError(f"Size of {target} differs from {source} after copy")
+    os.remove(source)
+    return method
+
+
+def calculate_partial_hash(file_path: Path, chunk_size: int = 65536) -> str:
+    """Hash the head, middle and tail of a file.
+
+    Files no larger than three chunks are hashed in full so that the result is identical
+    to that of calculate_file_hash.
+    """
+    size = file_path.stat().st_size
+    sha_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        if size <= 3 * chunk_size:
+            sha_hash.update(f.read())
+        else:
+            for offset in (0, (size - chunk_size) // 2, size - chunk_size):
+                f.seek(offset)
+                sha_hash.update(f.read(chunk_size))
+    return sha_hash.hexdigest()
+
+
 def calculate_pattern_length(pattern: str) -> int:
     length = 0
     i = 0
@@ -80,6 +278,36 @@ def extract_date_from_filename(date_str: str, pattern: str) -> datetime:
     return datetime.strptime(date_str[:date_length], pattern)
 
 
+def parse_date_range(value: str) -> Tuple[str, str]:
+    """Parse a date range in the format of YYYY[-MM[-DD]]..YYYY[-MM[-DD]].
+
+    :param value: A date range, or a single year, month, or day.
+    :return: Inclusive start and exclusive end of the range, as prefixes of dates in the
+        format of YYYYMMDD_HHMMSS that can be compared as strings.
+    """
+
+    def bound(date: str, upper: bool) -> str:
+        if not date:
+            return "9" if upper else ""
+        parts = date.split("-")
+        if len(parts) == 1:
+            year = datetime.strptime(date, "%Y").year
+            return f"{year + upper:04d}"
+        if len(parts) == 2:
+            month = datetime.strptime(date, "%Y-%m")
+            year, month_num = month.year, month.month + upper
+            if month_num > 12:
+                year, month_num = year + 1, 1
+            return f"{year:04d}{month_num:02d}"
+        day = datetime.strptime(date, "%Y-%m-%d") + timedelta(days=int(upper))
+        return day.strftime("%Y%m%d")
+
+    start, end = value.split("..", 1) if ".." in value else (value, value)
+    if not start and not end:
+        raise ValueError(f"Invalid date range {value}")
+    return bound(start.strip(), False), bound(end.strip(), True)
+
+
 def merge_dicts(dicts: list) -> dict:
     """Merge a list of dictionaries into a single dictionary, including nested dictionaries.
 
@@ -106,31 +334,120 @@ def merge_dicts(dicts: list) -> dict:
     return result
 
 
+class ExifToolPool:
+    """A pool of long-running exiftool processes shared by all threads of a process.
+
+    Processes are started when they are first needed and are reused afterwards, so that
+    the start-up cost of exiftool is paid once per process instead of once per file.
+    """
+
+    def __init__(self: "ExifToolPool", size: int | None = None) -> None:
+        self.size = size
+        self._reset()
+
+    def _reset(self: "ExifToolPool") -> None:
+        self._pid = os.getpid()
+        self._idle: List[ExifToolHelper] = []
+        self._count = 0
+        self._available = threading.Condition()
+        self._local = threading.local()
+
+    def _get(self: "ExifToolPool") -> ExifToolHelper:
+        with self._available:
+            while not self._idle and self._count >= (self.size or os.cpu_count() or 1):
+                self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+        try:
+            helper = ExifToolHelper()
+            helper.run()
+        except Exception:
+            with self._available:
+                self._count -= 1
+                self._available.notify()
+            raise
+        return helper
+
+    def _put(self: "ExifToolPool", helper: ExifToolHelper) -> None:
+        with self._available:
+            if helper.running:
+                self._idle.append(helper)
+            else:
+                self._count -= 1
+            self._available.notify()
+
+    @contextmanager
+    def acquire(self: "ExifToolPool") -> Generator[ExifToolHelper, None, None]:
+        """Yield a running exiftool, which is used only by the calling thread until released."""
+        if self._pid != os.getpid():
+            # processes started by a parent process cannot be used
+            self._reset()
+        # nested calls from the same thread reuse the same process
+        helper = getattr(self._local, "helper", None)
+        if helper is not None:
+            yield helper
+            return
+        helper = self._get()
+        self._local.helper = helper
+        try:
+            yield helper
+        finally:
+            self._local.helper = None
+            self._put(helper)
+
+    def close(self: "ExifToolPool") -> None:
+        """Terminate all idle exiftool processes of the current process."""
+        if self._pid != os.getpid():
+            return
+        with self._available:
+            for helper in self._idle:
+                # the process might have exited already
+                with suppress(Exception):
+                    helper.terminate()
+            self._count -= len(self._idle)
+            self._idle = []
+
+
+class TagName(str):
+    """Name of a tag in a parsed tag expression, which is never an operator."""
+
+
 ParserElement.enable_packrat()
 double_quoted_string = ('"' + CharsNotIn('"').leaveWhitespace() + '"').setParseAction(
-    lambda t: t[1]
+    lambda t: TagName(t[1])
 )  # removes quotes, keeps only the content
 single_quoted_string = ("'" + CharsNotIn("'").leaveWhitespace() + "'").setParseAction(
-    lambda t: t[1]
+    lambda t: TagName(t[1])
 )  # removes quotes, keeps only the content
 
+and_op = Keyword("AND")
+or_op = Keyword("OR")
+not_op = Keyword("NOT")
+
 special_chars = "-_=+.<>"
-unquoted_string = Word(alphanums + special_chars)
+unquoted_string = (~(and_op | or_op | not_op) + Word(alphanums + special_chars)).setParseAction(
+    lambda t: TagName(t[0])
+)
 
 operand = double_quoted_string | single_quoted_string | unquoted_string
-and_op = Keyword("AND")
-or_op = Keyword("OR")
 
 # Define the grammar for parsing
 expr = infix_notation(
     operand,
     [
+        (not_op, 1, opAssoc.RIGHT),
         (and_op, 2, opAssoc.LEFT),
         (or_op, 2, opAssoc.LEFT),
     ],
 )
 
 
+# Register JSON functions for better JSON handling
+sqlite3.register_adapter(dict, json.dumps)
+sqlite3.register_converter("JSON", json.loads)
+
+
 @dataclass
 class ManifestItem:
     filename: str
@@ -148,14 +465,30 @@ class Manifest:
     ) -> None:
         self.logger = logger
         self.cache: Dict[Path, ManifestItem] = {}
+        self._conn: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._lock = threading.RLock()
+        # number of changes before commit, 0 for committing each change immediately
+        self._batch_size = 0
+        self._pending_changes = 0
         self.init_db(filename)
 
     def init_db(self: "Manifest", filename: str | None, logger: Logger | None = None) -> None:
+        self.close()
         self.database_path = str(hmo_home / "manifest.db") if filename is None else filename
         if logger:
             self.logger = logger
         self._init_db()
 
+    def close(self: "Manifest") -> None:
+        """Commit pending changes and close the connection of the current process."""
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.commit()
+                self._conn.close()
+            self._conn = None
+            self._pending_changes = 0
+
     def get_all_tags(self: "Manifest") -> List[Dict[str, Any]]:
         with self._get_connection() as conn:
             cursor = conn.cursor()
@@ -164,17 +497,44 @@ class Manifest:
 
     @contextmanager
     def _get_connection(self: "Manifest") -> Generator[sqlite3.Connection, None, None]:
-        conn = sqlite3.connect(self.database_path)
-        # Enable JSON support
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA busy_timeout=30000")  # Set busy timeout to 30 seconds
-        # Register JSON functions for better JSON handling
-        sqlite3.register_adapter(dict, json.dumps)
-        sqlite3.register_converter("JSON", json.loads)
+        """Yield a long-lived connection, which is shared by all threads of a process."""
+        if self._pid != os.getpid():
+            # connections and locks inherited from a parent process cannot be used
+            self._lock = threading.RLock()
+            self._conn = None
+            self._pending_changes = 0
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.database_path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA busy_timeout=30000")  # Set busy timeout to 30 seconds
+                self._pid = os.getpid()
+            yield self._conn
+
+    def _commit(self: "Manifest", conn: sqlite3.Connection, changes: int = 1) -> None:
+        """Commit changes, or every batch_size changes inside a batch() context."""
+        self._pending_changes += changes
+        if self._pending_changes >= self._batch_size:
+            conn.commit()
+            self._pending_changes = 0
+
+    @contextmanager
+    def batch(self: "Manifest", batch_size: int = 1000) -> Generator["Manifest", None, None]:
+        """Group changes into transactions of batch_size changes.
+
+        Note that other processes cannot write to the database while a transaction is
+        pending, so worker processes should pass their results to the process that
+        holds the batch instead of writing to the manifest themselves.
+        """
+        previous_batch_size = self._batch_size
+        self._batch_size = batch_size
         try:
-            yield conn
+            yield self
         finally:
-            conn.close()
+            self._batch_size = previous_batch_size
+            with self._get_connection() as conn:
+                conn.commit()
+                self._pending_changes = 0
 
     def _init_db(self: "Manifest") -> None:
         with self._get_connection() as conn:
@@ -188,8 +548,131 @@ class Manifest:
                 )
             """
             )
+            self._init_tag_index(cursor)
+            # content derived values that are valid as long as the file is not changed
+            for table in ("signature", "perceptual_hash"):
+                cursor.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        device INTEGER,
+                        inode INTEGER,
+                        size INTEGER,
+                        mtime_ns INTEGER,
+                        hash_value TEXT,
+                        PRIMARY KEY (device, inode)
+                    )
+                """
+                )
+            # compressed exiftool output, which is valid as long as the file is not changed,
+            # renamed, or moved
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS exif (
+                    filename TEXT PRIMARY KEY,
+                    inode INTEGER,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    metadata BLOB
+                )
+            """
+            )
+            # resolved dates of media files, which are valid as long as the file is not
+            # changed, and are kept when the file is renamed, moved, or copied
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS media_date (
+                    filename TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    date TEXT,
+                    source TEXT
+                )
+            """
+            )
+            cursor.execute("CREATE INDEX IF NOT EXISTS media_date_date ON media_date (date)")
+            # runs of commands and their planned and completed items, so that a run that is
+            # interrupted can be resumed. finished is the time a run is finished, or
+            # "abandoned" for interrupted runs that are superseded by a new run
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS journal (
+                    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    command TEXT,
+                    started TEXT,
+                    finished TEXT
+                )
+            """
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS journal_item (
+                    run_id INTEGER,
+                    source TEXT,
+                    action TEXT,
+                    target TEXT,
+                    done INTEGER DEFAULT 0,
+                    PRIMARY KEY (run_id, source)
+                )
+            """
+            )
             conn.commit()
 
+    def _init_tag_index(self: "Manifest", cursor: sqlite3.Cursor) -> None:
+        """Create table file_tags that is kept in sync with the tags column by triggers.
+
+        The table allows lookup of files by tag with an index instead of parsing the JSON
+        tags of all files. file_id is the rowid of the manifest table.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_tags'")
+        existing = cursor.fetchone() is not None
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_tags (
+                file_id INTEGER,
+                tag TEXT,
+                PRIMARY KEY (tag, file_id)
+            ) WITHOUT ROWID
+        """
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS file_tags_file_id ON file_tags (file_id)")
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS manifest_insert_tags AFTER INSERT ON manifest
+            BEGIN
+                INSERT OR IGNORE INTO file_tags (file_id, tag)
+                SELECT NEW.rowid, key FROM json_each(NEW.tags);
+            END
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS manifest_update_tags AFTER UPDATE OF tags ON manifest
+            BEGIN
+                DELETE FROM file_tags WHERE file_id = OLD.rowid;
+                INSERT OR IGNORE INTO file_tags (file_id, tag)
+                SELECT NEW.rowid, key FROM json_each(NEW.tags);
+            END
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS manifest_delete_tags AFTER DELETE ON manifest
+            BEGIN
+                DELETE FROM file_tags WHERE file_id = OLD.rowid;
+            END
+        """
+        )
+        if not existing:
+            # index tags of manifest created by previous versions
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO file_tags (file_id, tag)
+                SELECT manifest.rowid, tag.key
+                FROM manifest, json_each(manifest.tags) AS tag
+                WHERE manifest.tags IS NOT NULL
+            """
+            )
+
     def _get_item(self: "Manifest", filename: Path) -> ManifestItem | None:
         with self._get_connection() as conn:
             cursor = conn.cursor()
@@ -209,18 +692,256 @@ class Manifest:
         return item.hash_value if item else default
 
     def set_hash(self: "Manifest", filename: Path, signature: str) -> None:
-        abs_path = filename.resolve()
+        self.set_hash_many([(filename, signature)])
+
+    def set_hash_many(self: "Manifest", items: Iterable[Tuple[Path, str]]) -> None:
+        params: List[Tuple[str, str, Dict[str, Any], str]] = [
+            (str(filename.resolve()), signature, {}, signature) for filename, signature in items
+        ]
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(
+            cursor.executemany(
                 """
                 INSERT INTO manifest (filename, hash_value, tags)
                 VALUES (?, ?, ?)
                 ON CONFLICT(filename) DO UPDATE SET hash_value = ?
             """,
-                (str(abs_path), signature, {}, signature),
+                params,
+            )
+            self._commit(conn, len(params))
+
+    def _get_stat_keyed(self: "Manifest", table: str, stat: os.stat_result) -> str | None:
+        """Return value from a table keyed by file stat if the file has not changed."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT hash_value FROM {table}
+                WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?
+                """,  # noqa: S608
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns),
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def _set_stat_keyed(
+        self: "Manifest", table: str, stat: os.stat_result, hash_value: str
+    ) -> None:
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                INSERT OR REPLACE INTO {table} (device, inode, size, mtime_ns, hash_value)
+                VALUES (?, ?, ?, ?, ?)
+                """,  # noqa: S608
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, hash_value),
+            )
+            self._commit(conn)
+
+    def get_signature(self: "Manifest", stat: os.stat_result) -> str | None:
+        """Return the cached signature of a file if it has not changed since it was hashed."""
+        return self._get_stat_keyed("signature", stat)
+
+    def set_signature(self: "Manifest", stat: os.stat_result, signature: str) -> None:
+        self._set_stat_keyed("signature", stat, signature)
+
+    def get_perceptual_hash(self: "Manifest", stat: os.stat_result) -> str | None:
+        """Return the cached perceptual hash of an image if it has not changed."""
+        return self._get_stat_keyed("perceptual_hash", stat)
+
+    def set_perceptual_hash(self: "Manifest", stat: os.stat_result, hash_value: str) -> None:
+        self._set_stat_keyed("perceptual_hash", stat, hash_value)
+
+    def get_exif(self: "Manifest", filename: Path, stat: os.stat_result) -> Dict[str, Any] | None:
+        """Return cached exiftool output of a file if it has not changed since it was read."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT metadata FROM exif
+                WHERE filename = ? AND inode = ? AND size = ? AND mtime_ns = ?
+                """,
+                (str(filename), stat.st_ino, stat.st_size, stat.st_mtime_ns),
+            )
+            row = cursor.fetchone()
+            return json.loads(zlib.decompress(row[0])) if row else None
+
+    def set_exif(self: "Manifest", filename: Path, stat: os.stat_result, metadata: Dict) -> None:
+        self.set_exif_many([(filename, stat, metadata)])
+
+    def set_exif_many(
+        self: "Manifest", items: Iterable[Tuple[Path, os.stat_result, Dict[str, Any]]]
+    ) -> None:
+        params = [
+            (
+                str(filename),
+                stat.st_ino,
+                stat.st_size,
+                stat.st_mtime_ns,
+                zlib.compress(json.dumps(metadata).encode()),
+            )
+            for filename, stat, metadata in items
+        ]
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT OR REPLACE INTO exif (filename, inode, size, mtime_ns, metadata)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                params,
+            )
+            self._commit(conn, len(params))
+
+    def remove_exif(self: "Manifest", filename: Path) -> None:
+        """Remove cached exiftool output of a file, which is needed after its EXIF is changed."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM exif WHERE filename = ?", (str(filename.resolve()),))
+            self._commit(conn)
+
+    def get_date(self: "Manifest", filename: Path, stat: os.stat_result) -> Tuple[str, str] | None:
+        """Return date of a file and where it came from, if the file has not changed."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT date, source FROM media_date
+                WHERE filename = ? AND size = ? AND mtime_ns = ?
+                """,
+                (str(filename), stat.st_size, stat.st_mtime_ns),
+            )
+            row = cursor.fetchone()
+            return (row[0], row[1]) if row else None
+
+    def set_date(
+        self: "Manifest", filename: Path, stat: os.stat_result, date: str, source: str
+    ) -> None:
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO media_date (filename, size, mtime_ns, date, source)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (str(filename), stat.st_size, stat.st_mtime_ns, date, source),
+            )
+            self._commit(conn)
+
+    def remove_date(self: "Manifest", filename: Path) -> None:
+        """Remove date of a file, which is needed after the date in its EXIF is changed."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM media_date WHERE filename = ?", (str(filename.resolve()),))
+            self._commit(conn)
+
+    def find_files_by_date(self: "Manifest", start: str, end: str) -> Set[str]:
+        """Find names of files with dates from start (inclusive) to end (exclusive)."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT filename FROM media_date WHERE date >= ? AND date < ?", (start, end)
+            )
+            res = {row[0] for row in cursor.fetchall()}
+        if self.logger:
+            self.logger.debug(f"Found {len(res)} files with dates from {start} to {end}")
+        return res
+
+    def start_run(self: "Manifest", command: str) -> int:
+        """Start a run of command, abandoning earlier runs of it that were not finished.
+
+        Items of abandoned runs are removed because the new run plans them again, and they
+        should never be resumed and rolled forward after the new run.
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                DELETE FROM journal_item WHERE run_id IN (
+                    SELECT run_id FROM journal WHERE command = ? AND finished IS NULL
+                )
+                """,
+                (command,),
+            )
+            cursor.execute(
+                "UPDATE journal SET finished = ? WHERE command = ? AND finished IS NULL",
+                ("abandoned", command),
+            )
+            cursor.execute(
+                "INSERT INTO journal (command, started) VALUES (?, ?)",
+                (command, datetime.now().isoformat()),
             )
             conn.commit()
+            return int(cursor.lastrowid or 0)
+
+    def find_run(self: "Manifest", command: str) -> int | None:
+        """Return the last run of command if it was interrupted."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT run_id, finished FROM journal WHERE command = ?
+                ORDER BY run_id DESC LIMIT 1
+                """,
+                (command,),
+            )
+            row = cursor.fetchone()
+            return row[0] if row and row[1] is None else None
+
+    def finish_run(self: "Manifest", run_id: int) -> None:
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE journal SET finished = ? WHERE run_id = ?",
+                (datetime.now().isoformat(), run_id),
+            )
+            cursor.execute("DELETE FROM journal_item WHERE run_id = ?", (run_id,))
+            self._commit(conn)
+
+    def add_journal_items(
+        self: "Manifest", run_id: int, items: Iterable[Tuple[str, str, str]], done: bool = False
+    ) -> None:
+        """Record items of a run as (action, source, target).
+
+        Planned items are committed right away, even in batch mode, so that they are known
+        to a resumed run if the process is killed while they are being applied.
+        """
+        params = [(run_id, source, action, target, int(done)) for action, source, target in items]
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT OR REPLACE INTO journal_item (run_id, source, action, target, done)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                params,
+            )
+            if done:
+                self._commit(conn, len(params))
+            else:
+                conn.commit()
+
+    def complete_journal_item(self: "Manifest", run_id: int, source: str) -> None:
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE journal_item SET done = 1 WHERE run_id = ? AND source = ?",
+                (run_id, source),
+            )
+            self._commit(conn)
+
+    def get_journal_items(self: "Manifest", run_id: int) -> List[Tuple[str, str, str, bool]]:
+        """Return (action, source, target, done) of items of a run in the order of recording."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT action, source, target, done FROM journal_item
+                WHERE run_id = ? ORDER BY rowid
+                """,
+                (run_id,),
+            )
+            return [(x[0], x[1], x[2], bool(x[3])) for x in cursor.fetchall()]
 
     def get_tags(self: "Manifest", filename: Path) -> Dict[str, Any]:
         if filename in self.cache:
@@ -232,16 +953,25 @@ class Manifest:
         return {}
 
     def add_tags(self: "Manifest", filename: Path, tags: Dict[str, Any] | List[str]) -> None:
-        abs_path = filename.resolve()
-        if not tags:
+        self.add_tags_many([(filename, tags)])
+
+    def add_tags_many(
+        self: "Manifest", items: Iterable[Tuple[Path, Dict[str, Any] | List[str]]]
+    ) -> None:
+        params: List[Tuple[str, Dict[str, Any], Dict[str, Any], Dict[str, Any]]] = []
+        for filename, tags in items:
+            if not tags:
+                continue
+            if isinstance(tags, list):
+                tags = {x: {} for x in tags}
+            params.append((str(filename.resolve()), tags, {}, tags))
+            self.cache.pop(filename, None)
+        if not params:
             return
-        if isinstance(tags, list):
-            tags = {x: {} for x in tags}
         with self._get_connection() as conn:
             cursor = conn.cursor()
             # Use JSON_PATCH or JSON_INSERT to merge the tags
-            # print(f"add {abs_path=} {tags=}")
-            cursor.execute(
+            cursor.executemany(
                 """
                 INSERT INTO manifest (filename, hash_value, tags)
                 VALUES (?, '', ?)
@@ -250,54 +980,60 @@ class Manifest:
                     COALESCE(tags, ?), ?
                 )
             """,
-                (str(abs_path), tags, {}, tags),
+                params,
             )
-            self.cache.pop(filename, None)
-            conn.commit()
+            self._commit(conn, len(params))
 
     def set_tags(self: "Manifest", filename: Path, tags: Dict[str, Any] | List[str]) -> None:
-        abs_path = filename.resolve()
-        if isinstance(tags, list):
-            tags = {x: {} for x in tags}
+        self.set_tags_many([(filename, tags)])
+
+    def set_tags_many(
+        self: "Manifest", items: Iterable[Tuple[Path, Dict[str, Any] | List[str]]]
+    ) -> None:
+        params = []
+        for filename, tags in items:
+            if isinstance(tags, list):
+                tags = {x: {} for x in tags}
+            # empty tags are saved as NULL
+            params.append((str(filename.resolve()), tags or None, tags or None))
+            self.cache.pop(filename, None)
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            if not tags:
-                cursor.execute(
-                    """
-                    INSERT INTO manifest (filename, hash_value, tags)
-                    VALUES (?, '', NULL)
-                    ON CONFLICT(filename) DO UPDATE SET tags = NULL
-                    """,
-                    (str(abs_path),),
-                )
-            else:
-                cursor.execute(
-                    """
-                    INSERT INTO manifest (filename, hash_value, tags)
-                    VALUES (?, '', ?)
-                    ON CONFLICT(filename) DO UPDATE SET tags = ?
-                    """,
-                    (str(abs_path), tags, tags),
-                )
-            self.cache.pop(filename, None)
-            conn.commit()
+            cursor.executemany(
+                """
+                INSERT INTO manifest (filename, hash_value, tags)
+                VALUES (?, '', ?)
+                ON CONFLICT(filename) DO UPDATE SET tags = ?
+                """,
+                params,
+            )
+            self._commit(conn, len(params))
 
     def rename(self: "Manifest", old_name: Path, new_name: Path) -> None:
-        abs_old_name = old_name.resolve()
-        abs_new_name = new_name.resolve()
+        self.rename_many([(old_name, new_name)])
+
+    def rename_many(self: "Manifest", items: Iterable[Tuple[Path, Path]]) -> None:
+        params = []
+        for old_name, new_name in items:
+            params.append((str(new_name.resolve()), str(old_name.resolve())))
+            self.cache.pop(old_name, None)
+            self.cache.pop(new_name, None)
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(
+            cursor.executemany(
                 """
                 UPDATE manifest
                 SET filename = ?
                 WHERE filename = ?
                 """,
-                (str(abs_new_name), str(abs_old_name)),
+                params,
             )
-            conn.commit()
-            self.cache.pop(old_name, None)
-            self.cache.pop(new_name, None)
+            # exiftool output contains the filename so it cannot be reused
+            cursor.executemany("DELETE FROM exif WHERE filename = ?", [(x[1],) for x in params])
+            cursor.executemany(
+                "UPDATE OR REPLACE media_date SET filename = ? WHERE filename = ?", params
+            )
+            self._commit(conn, len(params))
 
     def remove(self: "Manifest", filename: Path) -> None:
         abs_path = filename.resolve()
@@ -310,7 +1046,9 @@ class Manifest:
                 """,
                 (str(abs_path),),
             )
-            conn.commit()
+            cursor.execute("DELETE FROM exif WHERE filename = ?", (str(abs_path),))
+            cursor.execute("DELETE FROM media_date WHERE filename = ?", (str(abs_path),))
+            self._commit(conn)
             self.cache.pop(filename, None)
 
     def copy(self: "Manifest", old_name: Path, new_name: Path) -> None:
@@ -327,7 +1065,17 @@ class Manifest:
                 """,
                 (str(abs_new_name), str(abs_old_name)),
             )
-            conn.commit()
+            # modification time is preserved by copy so the date remains valid
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO media_date (filename, size, mtime_ns, date, source)
+                SELECT ?, size, mtime_ns, date, source
+                FROM media_date
+                WHERE filename = ?
+                """,
+                (str(abs_new_name), str(abs_old_name)),
+            )
+            self._commit(conn)
             self.cache.pop(new_name, None)
 
     def remove_tags(self: "Manifest", filename: Path, tags: List[str]) -> None:
@@ -338,12 +1086,12 @@ class Manifest:
                 cursor.execute(
                     """
                     UPDATE manifest
-                    SET tags = json_remove(tags, '$.' || ?)
+                    SET tags = json_remove(tags, '$."' || ? || '"')
                     WHERE filename = ?
                     """,
                     (tag, str(abs_path)),
                 )
-            conn.commit()
+            self._commit(conn)
             self.cache.pop(filename, None)
 
     def find_by_tag(self: "Manifest", tag_name: str) -> List[ManifestItem]:
@@ -353,8 +1101,8 @@ class Manifest:
             cursor.execute(
                 """
                 SELECT filename, hash_value, tags
-                FROM manifest
-                WHERE json_extract(tags, '$.' || ?) IS NOT NULL
+                FROM file_tags JOIN manifest ON manifest.rowid = file_tags.file_id
+                WHERE file_tags.tag = ?
                 """,
                 (tag_name,),
             )
@@ -377,7 +1125,7 @@ class Manifest:
             cursor.execute(
                 """
                 SELECT filename, hash_value, tags
-                FROM manifest WHERE tags IS NOT NULL
+                FROM manifest WHERE rowid IN (SELECT file_id FROM file_tags)
                 """
             )
             res = {
@@ -389,53 +1137,121 @@ class Manifest:
             self.cache |= res
             return list(res.values())
 
-    def find_by_tags(self: "Manifest", tag_names: List[str]) -> List[ManifestItem]:
-        """Find all items that have a specific tag."""
+    def _compile_tag_expression(
+        self: "Manifest", parsed_expression: str | ParseResults
+    ) -> Tuple[str, List[str]]:
+        """Compile a parsed tag expression to a query that selects file_id of matching files.
+
+        Operators are plain strings, and tags, including quoted tags such as "NOT", are
+        TagName so that they are not mistaken for operators.
+        """
+        if isinstance(parsed_expression, TagName):
+            return "SELECT file_id FROM file_tags WHERE tag = ?", [parsed_expression]
+
+        if len(parsed_expression) == 1:
+            return self._compile_tag_expression(parsed_expression[0])
+
+        def is_operator(token: Any, operators: Tuple[str, ...]) -> bool:
+            return not isinstance(token, TagName) and token in operators
+
+        if is_operator(parsed_expression[0], ("NOT",)):
+            query, params = self._compile_tag_expression(parsed_expression[1:])
+            # tags are passed as parameters, only subqueries are composed
+            return (
+                f"SELECT rowid FROM manifest EXCEPT SELECT * FROM ({query})",  # noqa: S608
+                params,
+            )
+
+        if is_operator(parsed_expression[-2], ("AND", "OR")):
+            query_a, params_a = self._compile_tag_expression(parsed_expression[:-2])
+            query_b, params_b = self._compile_tag_expression(parsed_expression[-1])
+            operator = "INTERSECT" if parsed_expression[-2] == "AND" else "UNION"
+            return (
+                f"SELECT * FROM ({query_a}) {operator} SELECT * FROM ({query_b})",  # noqa: S608
+                params_a + params_b,
+            )
+
+        raise ValueError(f"Invalid expression: {parsed_expression}")
+
+    def _tag_query(self: "Manifest", tag_names: List[str]) -> Tuple[str, List[str]] | None:
+        """Return a query that selects rowid of files matching tag_names, or None if invalid."""
         if not tag_names:
-            return self.get_files_with_any_tag()
+            return "SELECT file_id FROM file_tags", []
 
-        # inside tag_names, there can be AND.
+        # inside tag_names, there can be AND and NOT.
         expression = " OR ".join(tag_names)
 
         # parse the expression
         try:
             parsed = expr.parseString(expression, parseAll=True)[0]
+            return self._compile_tag_expression(parsed)
         except Exception as e:
             if self.logger:
-                self.logger.error(f"Invalid expression: {expr}")
+                self.logger.error(f"Invalid expression: {expression}")
                 self.logger.error(f"Error: {e}")
-                self.logger.error(f"Parsed: {parsed}")
-            return []
-
-        def evaluate_expression(parsed_expression: str | ParseResults) -> List[ManifestItem]:
-            if isinstance(parsed_expression, str):
-                return self.find_by_tag(parsed_expression)
-
-            if len(parsed_expression) == 1:
-                return evaluate_expression(parsed_expression[0])
-
-            if parsed_expression[-2] == "AND":
-                set_a = evaluate_expression(parsed_expression[:-2])
-                set_b = evaluate_expression(parsed_expression[-1])
-                common_keys = {x.filename for x in set_a} & {x.filename for x in set_b}
-                return [x for x in set_a if x.filename in common_keys]
+            return None
 
-            if parsed_expression[-2] == "OR":
-                set_a = evaluate_expression(parsed_expression[:-2])
-                set_b = evaluate_expression(parsed_expression[-1])
-                return list(
-                    ({x.filename: x for x in set_a} | {x.filename: x for x in set_b}).values()
+    def find_by_tags(self: "Manifest", tag_names: List[str]) -> List[ManifestItem]:
+        """Find all items that match specified tags or tag expressions."""
+        tag_query = self._tag_query(tag_names)
+        if tag_query is None:
+            return []
+        query, params = tag_query
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT filename, hash_value, tags
+                FROM manifest WHERE rowid IN ({query})
+                """,  # noqa: S608
+                params,
+            )
+            res = {
+                Path(row[0]): ManifestItem(
+                    filename=row[0], hash_value=row[1], tags=json.loads(row[2])
                 )
+                for row in cursor.fetchall()
+            }
+            self.cache |= res
+        if self.logger:
+            self.logger.debug(f"Found {len(res)} items with tags {tag_names}")
+        return list(res.values())
 
-            if self.logger:
-                self.logger.error(f"Invalid expression: {parsed_expression}")
-            return []
+    def find_files_by_tags(self: "Manifest", tag_names: List[str]) -> Set[str]:
+        """Find names of files that match specified tags, without reading their tags."""
+        tag_query = self._tag_query(tag_names)
+        if tag_query is None:
+            return set()
+        query, params = tag_query
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT filename FROM manifest WHERE rowid IN ({query})",  # noqa: S608
+                params,
+            )
+            res = {row[0] for row in cursor.fetchall()}
+        if self.logger:
+            self.logger.debug(f"Found {len(res)} files with tags {tag_names}")
+        return res
 
-        res = evaluate_expression(parsed)
+    def find_files_under(self: "Manifest", directory: str) -> List[str]:
+        """Find names of files under directory, in sorted order, using the filename index."""
+        prefix = os.path.join(directory, "")
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT filename FROM manifest WHERE filename >= ? AND filename < ? ORDER BY filename",
+                (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)),
+            )
+            res = [row[0] for row in cursor.fetchall()]
         if self.logger:
-            self.logger.debug(f"Found {len(res)} items with tags {tag_names}")
+            self.logger.debug(f"Found {len(res)} files under {directory}")
         return res
 
 
 # create a default manifest database, can be set to another path
 manifest = Manifest()
+
+# exiftool processes shared by all commands, the size can be set to the number of jobs
+exiftool_pool = ExifToolPool()
+atexit.register(exiftool_pool.close)
@@ -1,6 +1,7 @@
 import argparse
 import logging
 import os
+from functools import partial
 from multiprocessing import Pool
 from pathlib import Path
 from typing import Tuple
@@ -10,7 +11,7 @@ from PIL import Image, UnidentifiedImageError
 from tqdm import tqdm  # type: ignore
 
 from .home_media_organizer import iter_files
-from .utils import cache, calculate_file_hash, clear_cache, get_response, manifest
+from .utils import cache, clear_cache, get_file_hash, get_response, manifest
 
 try:
     import ffmpeg  # type: ignore
@@ -50,10 +51,10 @@ def mpg_playable(file_path: str) -> bool:
 #
 # check jpeg
 #
-def check_media_file(item: Path) -> Tuple[Path, str, bool]:
+def check_media_file(item: Path, refresh: bool = False) -> Tuple[Path, str, bool]:
     return (
         item,
-        calculate_file_hash(item),
+        get_file_hash(item, refresh=refresh, save=False),
         (item.suffix in (".jpg", ".jpeg") and not jpeg_openable(item))
         or (item.suffix.lower() in (".mp4", ".mpg") and not mpg_playable(item)),
     )
@@ -63,54 +64,61 @@ def validate_media_files(args: argparse.Namespace, logger: logging.Logger | None
     if args.no_cache:
         clear_cache(tag="validate")
 
+    # files that have been validated by an interrupted run are skipped
+    run_id = manifest.find_run("validate") if args.resume else None
+    if run_id is None:
+        run_id = manifest.start_run("validate")
+        validated = set()
+    else:
+        validated = {x[1] for x in manifest.get_journal_items(run_id) if x[3]}
+        if logger is not None:
+            logger.info(f"Skipping [blue]{len(validated)}[/blue] files that have been validated.")
+    files = (x for x in iter_files(args) if str(x) not in validated)
+
     if args.confirmed is not None or not args.remove:
-        with Pool(args.jobs or None) as pool:
+        with Pool(args.jobs or None) as pool, manifest.batch():
             # get file size
             for item, new_hash, corrupted in tqdm(
-                pool.imap(check_media_file, iter_files(args)),
+                pool.imap(partial(check_media_file, refresh=args.no_cache), files),
                 desc="Validate media",
             ):
+                manifest.set_signature(item.stat(), new_hash)
                 existing_hash = manifest.get_hash(item, None)
                 if existing_hash is not None and existing_hash != new_hash:
                     if logger is not None:
                         logger.warning(f"[red][bold]{item}[/bold] is corrupted.[/red]")
-                    continue
-                if corrupted:
+                elif corrupted:
                     if logger is not None:
                         logger.info(f"[red][bold]{item}[/bold] is not playable.[/red]")
-                    continue
-                if args.manifest:
+                elif args.manifest:
                     manifest.set_hash(item, new_hash)
+                manifest.add_journal_items(run_id, [("validate", str(item), "")], done=True)
     else:
-        for item in iter_files(args):
-            _, new_hash, corrupted = check_media_file(item)
+        for item in files:
+            _, new_hash, corrupted = check_media_file(item, refresh=args.no_cache)
+            manifest.set_signature(item.stat(), new_hash)
             existing_hash = manifest.get_hash(item, None)
             if existing_hash is not None and existing_hash != new_hash:
                 if logger is not None:
                     logger.warning(f"[red][bold]{item}[/bold] is corrupted.[/red]")
-                if args.remove:
-                    if args.confirmed is False:
-                        if logger is not None:
-                            logger.info(f"[green]DRYRUN[/green] Would remove {item}.")
-                    elif args.confirmed or get_response("Remove it?"):
-                        if logger is not None:
-                            logger.info(f"[red][bold]{item}[/bold] is removed.[/red]")
-                        os.remove(item)
-                continue
-            if corrupted:
+            elif corrupted:
                 if logger is not None:
                     logger.warning(f"[red][bold]{item}[/bold] is not playable.[/red]")
-                if args.remove:
-                    if args.confirmed is False:
-                        if logger is not None:
-                            logger.info(f"[green]DRYRUN[/green] Would remove {item}.")
-                    elif args.confirmed or get_response("Remove it?"):
-                        if logger is not None:
-                            logger.info(f"[red][bold]{item}[/bold] is removed.[/red]")
-                        os.remove(item)
+            else:
+                if args.manifest:
+                    manifest.set_hash(item, new_hash)
+                manifest.add_journal_items(run_id, [("validate", str(item), "")], done=True)
                 continue
-            if args.manifest:
-                manifest.set_hash(item, new_hash)
+            if args.remove:
+                if args.confirmed is False:
+                    if logger is not None:
+                        logger.info(f"[green]DRYRUN[/green] Would remove {item}.")
+                elif args.confirmed or get_response("Remove it?"):
+                    if logger is not None:
+                        logger.info(f"[red][bold]{item}[/bold] is removed.[/red]")
+                    os.remove(item)
+            manifest.add_journal_items(run_id, [("validate", str(item), "")], done=True)
+    manifest.finish_run(run_id)
 
 
 def get_validate_parser(subparsers: argparse._SubParsersAction) -> argparse.ArgumentParser:
@@ -124,7 +132,14 @@ def get_validate_parser(subparsers: argparse._SubParsersAction) -> argparse.Argu
     parser.add_argument(
         "--no-cache",
         action="store_true",
-        help="invalidate cached validation results and re-validate all files again.",
+        help="""Invalidate cached validation results and file signatures, and re-validate all
+            files again. By default files that have not been changed since they were last
+            validated are not re-read, so use this option to detect silent data corruption.""",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="""Resume the last interrupted run, skipping files that have been validated.""",
     )
     parser.set_defaults(func=validate_media_files, command="validate")
     return parser
@@ -0,0 +1,171 @@
+"""Tests for `home_media_organizer`.classify module."""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import pytest
+from diskcache import Cache  # type: ignore
+
+from home_media_organizer import classify
+from home_media_organizer.classify import (
+    DeepFaceAnalyzeClassifier,
+    NSFWClassifier,
+    chunked,
+    get_signature,
+    group_by_content,
+)
+from home_media_organizer.utils import calculate_file_hash, manifest
+
+
+class NudeDetector:
+    """Detector that records the images it is asked to classify."""
+
+    def __init__(self) -> None:
+        self.detected: List[str] = []
+
+    def detect(self, filename: str) -> List[Dict[str, Any]]:
+        self.detected.append(filename)
+        return [{"class": "FACE_FEMALE", "score": 0.9, "box": [0, 0, 1, 1]}]
+
+
+class BatchNudeDetector(NudeDetector):
+    def __init__(self) -> None:
+        super().__init__()
+        self.batches: List[List[str]] = []
+
+    def detect_batch(self, filenames: List[str], batch_size: int) -> List[List[Dict[str, Any]]]:
+        self.batches.append(filenames)
+        return [[{"class": "FACE_MALE", "score": 0.8, "box": [0, 0, 1, 1]}] for _ in filenames]
+
+
+def analyze(img_path: str, actions: List[str], detector_backend: str) -> List[Dict[str, Any]]:
+    """Result of DeepFace.analyze with one face."""
+    face: Dict[str, Any] = {"region": {"x": 0, "y": 0, "w": 1, "h": 1}, "face_confidence": 0.9}
+    if "age" in actions:
+        face |= {"age": 30}
+    if "gender" in actions:
+        face |= {"gender": {"Woman": 90.0, "Man": 10.0}, "dominant_gender": "Woman"}
+    if "emotion" in actions:
+        face |= {"emotion": {"happy": 80.0, "sad": 20.0}, "dominant_emotion": "happy"}
+    return [face]
+
+
+@pytest.fixture
+def images(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> List[Path]:
+    """Images with different content, and an empty cache of classification results."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    monkeypatch.setattr(classify, "cache", Cache(tmp_path / "cache"))
+    monkeypatch.setattr(classify, "batch_signatures", {})
+    files = [tmp_path / f"{x}.jpg" for x in "abc"]
+    for filename in files:
+        filename.write_text(filename.stem)
+    return files
+
+
+def test_group_by_content(tmp_path: Path) -> None:
+    """Identical copies are classified once, and new signatures are saved."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    files = [tmp_path / f"{x}.jpg" for x in "abc"]
+    for filename, content in zip(files, ("a", "b", "a")):
+        filename.write_text(content)
+    groups = group_by_content(map(get_signature, [*files, tmp_path / "missing.jpg"]))
+    assert groups == [
+        ([files[0], files[2]], calculate_file_hash(files[0])),
+        ([files[1]], calculate_file_hash(files[1])),
+        ([tmp_path / "missing.jpg"], None),
+    ]
+    assert manifest.get_signature(files[2].stat()) == calculate_file_hash(files[0])
+    assert get_signature(files[1])[2] is None
+    #
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_classify_batch(images: List[Path], monkeypatch: pytest.MonkeyPatch) -> None:
+    """Only images without cached results are classified, in one batch."""
+    classifier = NSFWClassifier("nsfw", None, None, None, None, None)
+    detector = BatchNudeDetector()
+    monkeypatch.setitem(classify.loaded_models, classifier.fullname, detector)
+    cached = [{"class": "BELLY_COVERED", "score": 0.7, "box": [0, 0, 1, 1]}]
+    classify.cache.set(classifier._cache_key(images[1]), cached)
+    results = classifier.classify_batch(images)
+    assert detector.batches == [[str(images[0]), str(images[2])]]
+    assert detector.detected == []
+    assert [list(x) for x in results] == [["FACE_MALE"], ["BELLY_COVERED"], ["FACE_MALE"]]
+    # results are cached
+    assert classifier.classify_batch(images) == results
+    assert len(detector.batches) == 1
+
+
+def test_classify_batch_fallback(images: List[Path], monkeypatch: pytest.MonkeyPatch) -> None:
+    """Images are classified one by one if the detector does not support batches."""
+    classifier = NSFWClassifier("nsfw", None, None, None, None, None)
+    detector = NudeDetector()
+    monkeypatch.setitem(classify.loaded_models, classifier.fullname, detector)
+    results = classifier.classify_batch(images)
+    assert detector.detected == [str(x) for x in images]
+    assert [list(x) for x in results] == [["FACE_FEMALE"]] * 3
+
+
+def test_deepface_analyze(images: List[Path], monkeypatch: pytest.MonkeyPatch) -> None:
+    """Classifiers with the same backend share one DeepFace.analyze call per image."""
+    calls = []
+
+    def mock_analyze(**kwargs: Any) -> List[Dict[str, Any]]:
+        calls.append(kwargs)
+        return analyze(**kwargs)
+
+    deepface = SimpleNamespace(DeepFace=SimpleNamespace(analyze=mock_analyze))
+    monkeypatch.setitem(sys.modules, "deepface", deepface)
+    # classifiers are restored after the test
+    monkeypatch.setattr(classify, "classifiers", [])
+    classify.init_classifiers(("age", "gender", "emotion"), None, None, None, None, None)
+    _, tags = classify.classify_images([(images[0], None)])[0]
+    assert calls == [
+        {
+            "img_path": str(images[0]),
+            "actions": ["age", "gender", "emotion"],
+            "detector_backend": "opencv",
+        }
+    ]
+    assert set(tags) == {"adult", "Woman", "happy"}
+    # each classifier caches only its own results and the detected face
+    for model in classify.classifiers:
+        assert isinstance(model, DeepFaceAnalyzeClassifier)
+        (cached,) = classify.cache.get(model._cache_key(images[0]))
+        assert set(cached) == {*model.result_keys, *model.face_keys}
+    #
+    calls.clear()
+    classify.init_classifiers(("age", "gender:deepface:retinaface"), None, None, None, None, None)
+    classify.classify_images([(images[1], None)])
+    assert [(x["actions"], x["detector_backend"]) for x in calls] == [
+        (["age"], "opencv"),
+        (["gender"], "retinaface"),
+    ]
+
+
+def test_cache_key(images: List[Path], monkeypatch: pytest.MonkeyPatch) -> None:
+    """Results are cached by content and version of model, and then by file name."""
+    classifier = NSFWClassifier("nsfw", None, None, None, None, None)
+    detector = NudeDetector()
+    monkeypatch.setitem(classify.loaded_models, classifier.fullname, detector)
+    classifier.classify_batch([images[0]])
+    # renamed file is not classified again
+    renamed = images[0].with_name("renamed.jpg")
+    images[0].rename(renamed)
+    assert list(classifier.classify_batch([renamed])[0]) == ["FACE_FEMALE"]
+    assert detector.detected == [str(images[0])]
+    # new version of the model
+    monkeypatch.setattr(classify, "get_package_version", lambda package: "999.0")
+    classifier.classify_batch([renamed])
+    assert detector.detected == [str(images[0]), str(renamed)]
+    # files that cannot be read are cached by name
+    missing = images[0].with_name("missing.jpg")
+    assert classifier._cache_key(missing) == classifier._path_cache_key(missing)
+    # results cached by name are found for files that can be read
+    cached = [{"class": "FEET_COVERED", "score": 0.7, "box": [0, 0, 1, 1]}]
+    classify.cache.set(classifier._path_cache_key(images[1]), cached)
+    assert list(classifier.classify_batch([images[1]])[0]) == ["FEET_COVERED"]
+    assert classify.cache.get(classifier._cache_key(images[1])) == cached
+    assert len(detector.detected) == 2
@@ -53,6 +53,20 @@ def test_config(config_file: Callable) -> None:
     assert args.format == "%Y%m%d_%H%M%S"
 
 
+def test_config_date_range(tmp_path: Path) -> None:
+    """Date ranges from configuration files are parsed as those from command line."""
+    cfg = tmp_path / "test.toml"
+    cfg.write_text('[list]\ndate-range = "2019-01..2019-06"\n')
+    args = cli.parse_args(["list", "--config", str(cfg), "file1"])
+    assert args.date_range == ("201901", "201907")
+    args = cli.parse_args(["list", "--config", str(cfg), "--date-range", "2020", "file1"])
+    assert args.date_range == ("2020", "2021")
+    #
+    cfg.write_text('[list]\ndate-range = "2019/01"\n')
+    with pytest.raises(SystemExit):
+        cli.parse_args(["list", "--config", str(cfg), "file1"])
+
+
 def test_list(image_file: Callable) -> None:
     fn = image_file()
     result = subprocess.run(["hmo", "list", fn], capture_output=True, text=True)
@@ -0,0 +1,53 @@
+"""Tests for `home_media_organizer`.dedup module."""
+
+from pathlib import Path
+
+from home_media_organizer import cli
+from home_media_organizer.dedup import find_duplicated_files, find_similar_files
+from home_media_organizer.utils import manifest
+
+
+def test_find_similar_files() -> None:
+    """Files are grouped if their hashes differ by no more than max_distance bits."""
+    hashes = {
+        Path("a.jpg"): 0xFFFF0000FFFF0000,
+        Path("b.jpg"): 0xFFFF0000FFFF0003,
+        Path("c.jpg"): 0xFFFF0000FFFF0000,
+        Path("d.jpg"): 0x0000FFFF0000FFFF,
+    }
+    groups = find_similar_files(hashes, max_distance=2)
+    assert len(groups) == 1
+    assert sorted(groups[0]) == [Path("a.jpg"), Path("b.jpg"), Path("c.jpg")]
+    #
+    assert len(find_similar_files(hashes, max_distance=1)[0]) == 2
+
+
+def test_find_similar_files_is_not_transitive() -> None:
+    """Only files within max_distance bits of the kept file are grouped with it."""
+    hashes = {
+        Path("a.jpg"): 0b0000,
+        Path("b.jpg"): 0b0011,
+        Path("c.jpg"): 0b1111,
+    }
+    sizes = {Path("a.jpg"): 100, Path("b.jpg"): 200, Path("c.jpg"): 300}
+    groups = find_similar_files(hashes, max_distance=2, key=lambda x: sizes[x])
+    # c.jpg is kept, b.jpg is similar to it, and a.jpg, which is 4 bits away from c.jpg,
+    # is not removed although it is similar to b.jpg
+    assert groups == [[Path("b.jpg"), Path("c.jpg")]]
+    assert all(Path("a.jpg") not in files for files in groups)
+
+
+def test_find_duplicated_files_of_different_sizes(tmp_path: Path) -> None:
+    """Small files are not duplicates of larger files with the same head, middle and tail."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    media = tmp_path / "media"
+    media.mkdir()
+    (media / "small.jpg").write_bytes(b"aaaabbbbcccc")
+    (media / "small_copy.jpg").write_bytes(b"aaaabbbbcccc")
+    (media / "large.jpg").write_bytes(b"aaaaxxbbbbyycccc")
+    (media / "large_2.jpg").write_bytes(b"aaaazzbbbbwwcccc")
+    args = cli.parse_args(["dedup", str(media), "--chunk-size", "4", "-j", "1"])
+    groups = find_duplicated_files(args)
+    assert [sorted(x.name for x in files) for files in groups] == [
+        ["small.jpg", "small_copy.jpg"]
+    ]
@@ -1,6 +1,95 @@
 """Tests for `home_media_organizer` module."""
 
+import argparse
+import os
+from pathlib import Path
+
+from home_media_organizer.home_media_organizer import PathIndex, iter_files
+from home_media_organizer.media_file import MediaFile
+from home_media_organizer.utils import manifest, parse_date_range
+
 
 def test_version(version: str) -> None:
     """Sample pytest test function with the pytest fixture as an argument."""
     assert version == "0.3.6"
+
+
+def test_path_index() -> None:
+    """Files under a directory are found without matching sibling directories by prefix."""
+    root = os.path.join(os.sep, "photos")
+    index = PathIndex(
+        [
+            os.path.join(root, "2020", "a.jpg"),
+            os.path.join(root, "2020-old", "b.jpg"),
+            os.path.join(root, "2020", "01", "c.jpg"),
+            os.path.join(root, "2021", "d.jpg"),
+        ]
+    )
+    assert len(index) == 4
+    assert os.path.join(root, "2021", "d.jpg") in index
+    assert index.has_files_under(root)
+    assert index.has_files_under(os.path.join(root, "2020", "01"))
+    assert not index.has_files_under(os.path.join(root, "2022"))
+    assert not index.has_files_under(os.path.join(root, "202"))
+    assert index.files_under(os.path.join(root, "2020")) == [
+        os.path.join(root, "2020", "01", "c.jpg"),
+        os.path.join(root, "2020", "a.jpg"),
+    ]
+
+
+def test_iter_files_from_manifest(tmp_path: Path) -> None:
+    """Files with tags are listed from the manifest without scanning directories."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    (tmp_path / "album").mkdir()
+    (tmp_path / "album-old").mkdir()
+    for name in ["album/1.jpg", "album/2.jpg", "album/3.jpg", "album-old/4.jpg"]:
+        (tmp_path / name).write_text(name)
+        manifest.add_tags(tmp_path / name, ["baby"])
+    manifest.add_tags(tmp_path / "album" / "5.jpg", ["baby"])
+    manifest.add_tags(tmp_path / "album" / "2.jpg", ["sad"])
+    args = argparse.Namespace(
+        items=[str(tmp_path / "album")],
+        file_types=None,
+        with_tags=["baby"],
+        without_tags=["sad"],
+        with_exif=None,
+        without_exif=None,
+        search_paths=None,
+        jobs=2,
+    )
+    assert list(iter_files(args)) == [tmp_path / "album" / "1.jpg", tmp_path / "album" / "3.jpg"]
+    #
+    assert manifest.find_files_under(str(tmp_path / "album")) == [
+        str(tmp_path / "album" / f"{i}.jpg") for i in (1, 2, 3, 5)
+    ]
+
+
+def test_iter_files_by_date(tmp_path: Path) -> None:
+    """Resolved dates are saved to the manifest and kept after files are renamed."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    fn = tmp_path / "20200102_030405.3gp"
+    fn.write_text("video")
+    assert MediaFile(fn).resolve_date() == "20200102_030405"
+    assert manifest.get_date(fn, fn.stat()) == ("20200102_030405", "filename_date")
+    new_fn = tmp_path / "video.3gp"
+    fn.rename(new_fn)
+    manifest.rename(fn, new_fn)
+    assert manifest.get_date(new_fn, new_fn.stat()) == ("20200102_030405", "filename_date")
+    #
+    args = argparse.Namespace(
+        items=[str(tmp_path)],
+        file_types=None,
+        with_tags=None,
+        without_tags=None,
+        with_exif=None,
+        without_exif=None,
+        search_paths=None,
+        jobs=2,
+        date_range=parse_date_range("2020-01"),
+    )
+    for from_manifest in (False, True):
+        args.from_manifest = from_manifest
+        args.date_range = parse_date_range("2020-01")
+        assert list(iter_files(args)) == [new_fn]
+        args.date_range = parse_date_range("2020-02..")
+        assert list(iter_files(args)) == []
@@ -0,0 +1,141 @@
+"""Tests for `home_media_organizer`.media_file module."""
+
+import struct
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from home_media_organizer import media_file
+from home_media_organizer.media_file import (
+    FilenameDatePatterns,
+    MediaFile,
+    filename_date,
+    header_date,
+    prefetch_exif,
+)
+from home_media_organizer.utils import manifest
+
+
+def exif_data(date: str) -> bytes:
+    """TIFF structured EXIF data with DateTimeOriginal in an Exif IFD."""
+    return (
+        b"II*\0"
+        + struct.pack("<I", 8)
+        # IFD0 with a pointer to Exif IFD at offset 26
+        + struct.pack("<HHHII", 1, 0x8769, 4, 1, 26)
+        + struct.pack("<I", 0)
+        # Exif IFD with DateTimeOriginal at offset 44
+        + struct.pack("<HHHII", 1, 0x9003, 2, 20, 44)
+        + struct.pack("<I", 0)
+        + date.encode()
+        + b"\0"
+    )
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def test_jpeg_header_date(tmp_path: Path) -> None:
+    """Date is read from the APP1 segment of JPEG files."""
+    exif = b"Exif\0\0" + exif_data("2020:01:02 03:04:05")
+    fn = tmp_path / "test.jpg"
+    fn.write_bytes(
+        b"\xff\xd8\xff\xe0"
+        + struct.pack(">H", 6)
+        + b"JFIF"
+        + b"\xff\xe1"
+        + struct.pack(">H", len(exif) + 2)
+        + exif
+        + b"\xff\xda"
+    )
+    assert header_date(fn) == "2020:01:02 03:04:05"
+    #
+    fn.write_bytes(b"\xff\xd8\xff\xda")
+    assert header_date(fn) is None
+
+
+def test_heic_header_date(tmp_path: Path) -> None:
+    """Date is read from the Exif item of HEIC files."""
+    exif = struct.pack(">I", 6) + b"Exif\0\0" + exif_data("2021:02:03 04:05:06")
+    infe = box(b"infe", b"\x02\0\0\0" + struct.pack(">HH4s", 1, 0, b"Exif") + b"\0")
+    iinf = box(b"iinf", b"\0\0\0\0" + struct.pack(">H", 1) + infe)
+
+    def iloc(offset: int) -> bytes:
+        return box(
+            b"iloc",
+            b"\0\0\0\0" + b"\x44\x00" + struct.pack(">HHHHII", 1, 1, 0, 1, offset, len(exif)),
+        )
+
+    ftyp = box(b"ftyp", b"heic\0\0\0\0")
+    meta_size = len(box(b"meta", b"\0\0\0\0" + iinf + iloc(0)))
+    meta = box(b"meta", b"\0\0\0\0" + iinf + iloc(len(ftyp) + meta_size + 8))
+    fn = tmp_path / "test.heic"
+    fn.write_bytes(ftyp + meta + box(b"mdat", exif))
+    assert header_date(fn) == "2021:02:03 04:05:06"
+
+
+def test_quicktime_header_date(tmp_path: Path) -> None:
+    """Date is read from the mdhd atom of MP4 files, even if moov is after mdat."""
+    seconds = int((datetime(2022, 3, 4, 5, 6, 7) - datetime(1904, 1, 1)).total_seconds())
+    mdhd = box(b"mdhd", b"\0\0\0\0" + struct.pack(">III", 0, seconds, 1000) + b"\0" * 8)
+    moov = box(b"moov", box(b"mvhd", b"\0" * 100) + box(b"trak", box(b"mdia", mdhd)))
+    fn = tmp_path / "test.mp4"
+    fn.write_bytes(box(b"ftyp", b"isom\0\0\0\0") + box(b"mdat", b"\0" * 1000) + moov)
+    assert header_date(fn) == "2022:03:04 05:06:07"
+
+
+def test_prefetch_exif(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Dates read from headers are saved, and only other files are passed to exiftool."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    seconds = int((datetime(2022, 3, 4, 5, 6, 7) - datetime(1904, 1, 1)).total_seconds())
+    mdhd = box(b"mdhd", b"\0\0\0\0" + struct.pack(">III", 0, seconds, 1000) + b"\0" * 8)
+    dated = tmp_path / "dated.mp4"
+    dated.write_bytes(box(b"moov", box(b"trak", box(b"mdia", mdhd))))
+    undated = tmp_path / "undated.mp4"
+    undated.write_bytes(box(b"mdat", b"\0" * 100))
+    prefetched = []
+    monkeypatch.setattr(media_file, "get_exif_metadata", lambda x: prefetched.extend(x))
+    missing = tmp_path / "missing.mp4"
+    assert list(prefetch_exif([dated, missing, undated], jobs=2)) == [dated, missing, undated]
+    assert prefetched == [undated]
+    assert manifest.get_date(dated, dated.stat()) == ("20220304_050607", "header_date")
+    assert MediaFile(dated).resolve_date() == "20220304_050607"
+
+
+@pytest.mark.parametrize(
+    "filename,date",
+    [
+        ("2020-01-02_03.04.05.jpg", "20200102_030405"),
+        ("video-2020.01.02_03-04-05.mp4", "20200102_030405"),
+        ("20200102_vacation.jpg", "20200102_vacation"),
+        ("20200102.jpg", "20200102"),
+        ("IMG_20200102_030405.jpg", "20200102_030405"),
+        ("IMG_20200102_030405_1.jpg", "20200102_030405"),
+        ("PXL_20200102_030405123.jpg", "20200102_030405123"),
+        ("video-2020-1-2-vacation.mp4", "20200102_vacation"),
+        ("20.1.2-vacation.mp4", "20200102_vacation"),
+        ("voice-2020-01-02-03-04.m4a", "20200102_0304"),
+    ],
+)
+def test_filename_date(filename: str, date: str) -> None:
+    """Dates are extracted from common filename patterns."""
+    assert filename_date(Path(filename)) == date
+
+
+def test_filename_date_patterns() -> None:
+    """Added patterns take priority over existing ones."""
+    patterns = FilenameDatePatterns([(r"(?P<date>\d{8})(_.*)?", "{date}")])
+    assert patterns.match("20200102_030405") == "20200102"
+    assert patterns.match("DSC-030405-20200102") is None
+    patterns.add(
+        [
+            (r"DSC-(?P<time>\d{6})-(?P<date>\d{8})", "{date}_{time}"),
+            (r"(?P<date>\d{8})_(?P<time>\d{6})", "{date}_{time}"),
+        ]
+    )
+    assert patterns.match("DSC-030405-20200102") == "20200102_030405"
+    assert patterns.match("20200102_030405") == "20200102_030405"
+    with pytest.raises(ValueError):
+        patterns.add([(r"(?P<date>\d{8}", "{date}")])
@@ -0,0 +1,277 @@
+"""Tests for `home_media_organizer`.plan module."""
+
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from home_media_organizer import plan
+from home_media_organizer.media_file import MediaFile
+from home_media_organizer.plan import (
+    DirectoryCache,
+    Journal,
+    PlanAction,
+    PlanItem,
+    Planner,
+    apply_plan,
+    apply_plan_item,
+    read_plan,
+    write_plan,
+)
+from home_media_organizer.utils import (
+    OrganizeOperation,
+    calculate_file_hash,
+    manifest,
+    move_file,
+)
+
+
+def media_file(filename: Path, content: str, date: str = "20200102_030405") -> Path:
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    filename.write_text(content)
+    manifest.set_date(filename, filename.stat(), date, "test")
+    return filename
+
+
+def test_plan_rename(tmp_path: Path) -> None:
+    """Collisions with existing and planned files are resolved in memory."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    existing = media_file(tmp_path / "20200102_030405.3gp", "x")
+    files = [media_file(tmp_path / f"{x}.3gp", y) for x, y in (("a", "a"), ("b", "b"), ("c", "a"))]
+    planner = Planner(confirmed=True)
+    items = list(planner.plan(files, planner.plan_rename))
+    assert items == [
+        PlanItem(PlanAction.RENAME, files[0], tmp_path / "20200102_030405_1.3gp"),
+        PlanItem(PlanAction.RENAME, files[1], tmp_path / "20200102_030405_2.3gp"),
+        PlanItem(PlanAction.REMOVE, files[2], tmp_path / "20200102_030405_1.3gp"),
+    ]
+    # nothing is changed before the plan is applied
+    assert all(x.is_file() for x in files)
+    #
+    write_plan(items, str(tmp_path / "plan.jsonl"))
+    assert read_plan(str(tmp_path / "plan.jsonl"), [str(files[1])]) == items[1:2]
+    apply_plan(read_plan(str(tmp_path / "plan.jsonl"), [str(tmp_path)]), confirmed=True)
+    assert sorted(x.name for x in tmp_path.glob("*.3gp")) == [
+        "20200102_030405.3gp",
+        "20200102_030405_1.3gp",
+        "20200102_030405_2.3gp",
+    ]
+    assert existing.read_text() == "x"
+    assert (tmp_path / "20200102_030405_1.3gp").read_text() == "a"
+
+
+def test_plan_organize(tmp_path: Path) -> None:
+    """Files already in place are kept, and duplicates are removed when moving."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    library = tmp_path / "library"
+    in_place = media_file(library / "2020" / "2020-01" / "a.3gp", "a")
+    duplicate = media_file(tmp_path / "incoming" / "a.3gp", "a")
+    new = media_file(tmp_path / "incoming" / "b.3gp", "b", "20210102_030405")
+    planner = Planner(confirmed=True)
+    items = list(
+        planner.plan(
+            [in_place, duplicate, new],
+            lambda m: planner.plan_organize(m, library, "%Y/%Y-%m"),
+        )
+    )
+    assert items == [
+        PlanItem(PlanAction.REMOVE, duplicate, in_place),
+        PlanItem(PlanAction.MOVE, new, library / "2021" / "2021-01" / "b.3gp"),
+    ]
+    apply_plan(items, confirmed=True)
+    assert in_place.is_file()
+    assert not duplicate.exists()
+    assert (library / "2021" / "2021-01" / "b.3gp").read_text() == "b"
+    # dates are kept after the file is moved
+    assert MediaFile(library / "2021" / "2021-01" / "b.3gp").resolve_date() == "20210102_030405"
+
+
+def test_apply_plan_in_parallel(tmp_path: Path) -> None:
+    """Files with the same target directory are named as planned when applied in parallel."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    library = tmp_path / "library"
+    files = [
+        media_file(tmp_path / f"incoming{i}" / "a.3gp", str(i), f"20{10 + i % 3}0102_030405")
+        for i in range(15)
+    ]
+    planner = Planner(confirmed=True)
+    items = list(planner.plan(files, lambda m: planner.plan_organize(m, library, "%Y", album="x")))
+    assert len({x.target for x in items}) == 15
+    contents = {x.target: x.source.read_text() for x in items}
+    apply_plan(items, confirmed=True, jobs=4)
+    assert {x: x.read_text() for x in library.glob("*/*.3gp")} == contents
+    assert not any(x.exists() for x in files)
+
+
+def test_apply_plan_vacated_names(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Files that take the names of files moved out of a directory are applied after them."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    library = tmp_path / "library"
+    misplaced = [
+        media_file(library / f"20{10 + i}" / "a.3gp", f"old{i}", f"20{20 + i}0102_030405")
+        for i in range(8)
+    ]
+    incoming = [
+        media_file(tmp_path / f"incoming{i}" / "a.3gp", f"new{i}", f"20{10 + i}0102_030405")
+        for i in range(8)
+    ]
+    planner = Planner(confirmed=True)
+    items = list(
+        planner.plan(misplaced + incoming, lambda m: planner.plan_organize(m, library, "%Y"))
+    )
+    assert [x.target for x in items[8:]] == misplaced
+
+    def slow_move_file(source: Path, target: Path, **kwargs: Any) -> str:
+        # files moved out of the library are moved after other files are applied
+        if source in misplaced:
+            time.sleep(0.05)
+        return move_file(source, target, **kwargs)
+
+    monkeypatch.setattr(plan, "move_file", slow_move_file)
+    apply_plan(items, confirmed=True, jobs=4)
+    assert [x.read_text() for x in misplaced] == [f"new{i}" for i in range(8)]
+    assert not any(x.exists() for x in incoming)
+
+
+def test_apply_plan_copy(tmp_path: Path) -> None:
+    """Signatures of copied files are saved for both source and target."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    source = media_file(tmp_path / "incoming" / "a.3gp", "a")
+    planner = Planner(confirmed=True)
+    items = list(
+        planner.plan(
+            [source],
+            lambda m: planner.plan_organize(m, tmp_path, "%Y", operation=OrganizeOperation.COPY),
+        )
+    )
+    target = tmp_path / "2020" / "a.3gp"
+    assert items == [PlanItem(PlanAction.COPY, source, target)]
+    apply_plan(items, confirmed=True, verify=True)
+    assert target.read_text() == "a"
+    signature = calculate_file_hash(source)
+    assert manifest.get_signature(source.stat()) == signature
+    assert manifest.get_signature(target.stat()) == signature
+
+
+def test_same_content(tmp_path: Path) -> None:
+    """Collisions are resolved by sizes and cached signatures."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    existing = media_file(tmp_path / "20200102_030405.3gp", "aa")
+    files = [
+        media_file(tmp_path / f"{x}.3gp", y) for x, y in (("a", "ab"), ("b", "aaa"), ("c", "aa"))
+    ]
+    planner = Planner(confirmed=True, paranoid=True)
+    items = list(planner.plan(files, planner.plan_rename))
+    assert items == [
+        PlanItem(PlanAction.RENAME, files[0], tmp_path / "20200102_030405_1.3gp"),
+        PlanItem(PlanAction.RENAME, files[1], tmp_path / "20200102_030405_2.3gp"),
+        PlanItem(PlanAction.REMOVE, files[2], existing),
+    ]
+    # files of different sizes are not hashed
+    assert manifest.get_signature(files[1].stat()) is None
+    assert manifest.get_signature(files[2].stat()) == calculate_file_hash(existing)
+
+
+def test_directory_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Target directories are created and listed once when a plan is applied."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    library = tmp_path / "library"
+    files = [
+        media_file(tmp_path / "incoming" / f"{i}.3gp", str(i), f"20{10 + i % 3}0102_030405")
+        for i in range(12)
+    ]
+    planner = Planner(confirmed=True)
+    items = list(planner.plan(files, lambda m: planner.plan_organize(m, library, "%Y/%m")))
+    created = []
+    makedirs = os.makedirs
+
+    def record_makedirs(name: Path, **kwargs: Any) -> None:
+        created.append(name)
+        makedirs(name, **kwargs)
+
+    monkeypatch.setattr(os, "makedirs", record_makedirs)
+    apply_plan(items, confirmed=True, jobs=1)
+    # os.makedirs calls itself with str for missing parent directories
+    assert sorted(x for x in created if isinstance(x, Path)) == [
+        library / f"20{x}" / "01" for x in (10, 11, 12)
+    ]
+    assert len(list(library.glob("*/*/*.3gp"))) == 12
+    #
+    directories = DirectoryCache()
+    assert directories.exists(library / "2010" / "01" / "0.3gp")
+    assert not directories.exists(files[0])
+    directories.makedirs(library / "2013" / "01")
+    assert (library / "2013" / "01").is_dir()
+    directories.add(library / "2013" / "01" / "a.3gp")
+    assert directories.exists(library / "2013" / "01" / "a.3gp")
+
+
+def test_resume_journal(tmp_path: Path) -> None:
+    """Interrupted runs are resumed, and interrupted operations are rolled forward."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    library = tmp_path / "library"
+    files = [media_file(tmp_path / "incoming" / f"{i}.3gp", str(i)) for i in range(4)]
+    planner = Planner(confirmed=True)
+    items = list(planner.plan(files, lambda m: planner.plan_organize(m, library, "%Y")))
+    journal = Journal.start("organize")
+    assert list(journal.record(items)) == items
+    # completed and recorded
+    assert apply_plan_item(items[0], confirmed=True)
+    journal.complete(items[0])
+    # completed but not recorded
+    apply_plan_item(items[1], confirmed=True)
+    # interrupted after the file is copied to another file system
+    shutil.copy2(items[2].source, items[2].target)
+    #
+    assert Journal.resume("rename") is None
+    resumed = Journal.resume("organize", confirmed=True)
+    assert resumed is not None and resumed.items == items[3:]
+    assert not files[2].exists()
+    apply_plan(resumed.items, confirmed=True, journal=resumed)
+    assert sorted(x.name for x in (library / "2020").iterdir()) == [
+        "0.3gp",
+        "1.3gp",
+        "2.3gp",
+        "3.3gp",
+    ]
+    assert not any(x.exists() for x in files)
+    assert manifest.find_run("organize") is None
+
+
+def test_abandon_journal(tmp_path: Path) -> None:
+    """Interrupted runs are abandoned, and never resumed, when a new run is started."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    source = media_file(tmp_path / "incoming" / "a.3gp", "a")
+    item = PlanItem(PlanAction.REMOVE, source, tmp_path / "2020" / "a.3gp")
+    interrupted = Journal.start("organize")
+    assert list(interrupted.record([item])) == [item]
+    assert manifest.find_run("organize") == interrupted.run_id
+    # a new run plans again, and is finished
+    journal = Journal.start("organize")
+    assert manifest.get_journal_items(interrupted.run_id) == []
+    assert manifest.find_run("organize") == journal.run_id
+    journal.finish()
+    assert manifest.find_run("organize") is None
+    assert Journal.resume("organize", confirmed=True) is None
+    assert source.is_file()
+
+
+def test_apply_stale_remove(tmp_path: Path) -> None:
+    """Sources are not removed if their targets no longer have the same content."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    target = media_file(tmp_path / "20200102_030405.3gp", "a")
+    source = media_file(tmp_path / "a.3gp", "a")
+    planner = Planner(confirmed=True)
+    items = list(planner.plan([source], planner.plan_rename))
+    assert items == [PlanItem(PlanAction.REMOVE, source, target)]
+    # target is changed after the plan is made
+    target.write_text("bb")
+    assert not apply_plan_item(items[0], confirmed=True)
+    assert source.read_text() == "a"
+    # or the plan is edited
+    other = media_file(tmp_path / "b.3gp", "c")
+    assert not apply_plan_item(PlanItem(PlanAction.REMOVE, source, other), confirmed=True)
+    assert source.is_file()
@@ -0,0 +1,246 @@
+"""Tests for `home_media_organizer`.utils module."""
+
+import errno
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from home_media_organizer import utils
+from home_media_organizer.utils import (
+    CopyResult,
+    ExifToolPool,
+    Manifest,
+    calculate_file_hash,
+    calculate_partial_hash,
+    copy_file,
+    get_exif_metadata,
+    get_file_hash,
+    manifest,
+    move_file,
+    parse_date_range,
+)
+
+
+def test_file_hash_cache(tmp_path: Path) -> None:
+    """Cached signatures are invalidated when file content changes."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    fn = tmp_path / "test.jpg"
+    fn.write_bytes(b"original content")
+    assert get_file_hash(fn) == calculate_file_hash(fn)
+    assert manifest.get_signature(fn.stat()) == calculate_file_hash(fn)
+    #
+    # modify the file, keeping the same size
+    fn.write_bytes(b"modified content")
+    os.utime(fn, ns=(fn.stat().st_atime_ns, fn.stat().st_mtime_ns + 1000))
+    assert manifest.get_signature(fn.stat()) is None
+    assert get_file_hash(fn) == calculate_file_hash(fn)
+
+
+def test_partial_hash(tmp_path: Path) -> None:
+    """Partial hash covers head, middle, and tail of large files."""
+    small = tmp_path / "small.jpg"
+    small.write_bytes(b"x" * 100)
+    assert calculate_partial_hash(small, chunk_size=64) == calculate_file_hash(small)
+    #
+    large = tmp_path / "large.jpg"
+    content = bytearray(os.urandom(1000))
+    large.write_bytes(content)
+    partial_hash = calculate_partial_hash(large, chunk_size=64)
+    # change outside of the sampled blocks does not change partial hash
+    content[200] ^= 1
+    large.write_bytes(content)
+    assert calculate_partial_hash(large, chunk_size=64) == partial_hash
+    # change in the tail does
+    content[-1] ^= 1
+    large.write_bytes(content)
+    assert calculate_partial_hash(large, chunk_size=64) != partial_hash
+
+
+def test_manifest_batch(tmp_path: Path) -> None:
+    """Changes made in batch mode are visible and committed at the end of the batch."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    files = [tmp_path / f"{x}.jpg" for x in range(5)]
+    with manifest.batch(batch_size=2):
+        manifest.add_tags_many([(x, ["baby"]) for x in files])
+        manifest.set_hash_many([(x, "hash") for x in files])
+        manifest.rename_many([(files[0], tmp_path / "renamed.jpg")])
+        manifest.add_tags(files[1], {"happy": {"score": 0.9}})
+        assert manifest.get_tags(files[1]) == {"baby": {}, "happy": {"score": 0.9}}
+    #
+    reopened = Manifest(str(tmp_path / "manifest.db"))
+    assert reopened.get_hash(tmp_path / "renamed.jpg") == "hash"
+    assert reopened.get_tags(files[0]) == {}
+    assert reopened.get_tags(files[4]) == {"baby": {}}
+
+
+def test_tag_index(tmp_path: Path) -> None:
+    """Tag index is kept in sync with tags of files."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    manifest.add_tags(tmp_path / "a.jpg", ["baby", "middle eastern"])
+    manifest.add_tags(tmp_path / "b.jpg", ["baby"])
+    assert {x.filename for x in manifest.find_by_tag("baby")} == {
+        str(tmp_path / "a.jpg"),
+        str(tmp_path / "b.jpg"),
+    }
+    manifest.remove_tags(tmp_path / "a.jpg", ["baby", "middle eastern"])
+    manifest.rename(tmp_path / "b.jpg", tmp_path / "c.jpg")
+    assert [x.filename for x in manifest.find_by_tag("baby")] == [str(tmp_path / "c.jpg")]
+    assert manifest.find_by_tag("middle eastern") == []
+    manifest.remove(tmp_path / "c.jpg")
+    assert manifest.get_files_with_any_tag() == []
+
+
+def test_find_files_by_tags(tmp_path: Path) -> None:
+    """Tag expressions with AND, OR, and NOT."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    manifest.add_tags(tmp_path / "1.jpg", ["baby", "happy"])
+    manifest.add_tags(tmp_path / "2.jpg", ["toddler", "happy", "nsfw"])
+    manifest.add_tags(tmp_path / "3.jpg", ["toddler", "happy"])
+    manifest.add_tags(tmp_path / "4.jpg", ["baby"])
+    assert manifest.find_files_by_tags(["(baby OR toddler) AND happy AND NOT nsfw"]) == {
+        str(tmp_path / "1.jpg"),
+        str(tmp_path / "3.jpg"),
+    }
+    assert manifest.find_files_by_tags(["nsfw", "NOT happy"]) == {
+        str(tmp_path / "2.jpg"),
+        str(tmp_path / "4.jpg"),
+    }
+    assert len(manifest.find_files_by_tags([])) == 4
+    assert manifest.find_files_by_tags(["baby AND"]) == set()
+
+
+def test_find_files_by_quoted_tags(tmp_path: Path) -> None:
+    """Quoted operators and lowercase operators are names of tags."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    manifest.add_tags(tmp_path / "1.jpg", ["NOT", "baby"])
+    manifest.add_tags(tmp_path / "2.jpg", ["not", "AND"])
+    manifest.add_tags(tmp_path / "3.jpg", ["baby"])
+    assert manifest.find_files_by_tags(['"NOT"']) == {str(tmp_path / "1.jpg")}
+    assert manifest.find_files_by_tags(["'NOT' AND baby"]) == {str(tmp_path / "1.jpg")}
+    assert manifest.find_files_by_tags(['NOT "NOT"']) == {
+        str(tmp_path / "2.jpg"),
+        str(tmp_path / "3.jpg"),
+    }
+    assert manifest.find_files_by_tags(["not", '"AND" OR baby']) == {
+        str(tmp_path / "1.jpg"),
+        str(tmp_path / "2.jpg"),
+        str(tmp_path / "3.jpg"),
+    }
+    assert manifest.find_files_by_tags(["not AND NOT 'AND'"]) == set()
+
+
+@pytest.mark.skipif(shutil.which("exiftool") is None, reason="exiftool is not installed")
+def test_exiftool_pool() -> None:
+    """Processes of exiftool are reused across and within calls."""
+    pool = ExifToolPool(size=1)
+    with pool.acquire() as e1:
+        with pool.acquire() as e2:
+            assert e1 is e2
+    with pool.acquire() as e3:
+        assert e3 is e1
+        assert e3.running
+    pool.close()
+    assert not e1.running
+
+
+def test_exif_catalog(tmp_path: Path) -> None:
+    """Cached exiftool output is invalidated when files are changed or renamed."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    fn = tmp_path / "test.jpg"
+    fn.write_bytes(b"original content")
+    metadata = {"SourceFile": str(fn), "EXIF:Model": "Pixel"}
+    manifest.set_exif(fn, fn.stat(), metadata)
+    assert manifest.get_exif(fn, fn.stat()) == metadata
+    #
+    fn.write_bytes(b"modified content!")
+    assert manifest.get_exif(fn, fn.stat()) is None
+    #
+    manifest.set_exif(fn, fn.stat(), metadata)
+    new_fn = tmp_path / "new.jpg"
+    fn.rename(new_fn)
+    manifest.rename(fn, new_fn)
+    assert manifest.get_exif(fn, new_fn.stat()) is None
+    assert manifest.get_exif(new_fn, new_fn.stat()) is None
+
+
+def test_exif_catalog_resolved(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Cached exiftool output is shared by relative and symlinked names of a file."""
+    manifest.init_db(str(tmp_path / "manifest.db"))
+    fn = tmp_path / "test.jpg"
+    fn.write_bytes(b"original content")
+    metadata = {"SourceFile": str(fn), "EXIF:Model": "Pixel"}
+    manifest.set_exif(fn.resolve(), fn.stat(), metadata)
+    link = tmp_path / "link.jpg"
+    link.symlink_to(fn)
+    monkeypatch.chdir(tmp_path)
+    assert get_exif_metadata([Path("test.jpg"), link]) == [metadata, metadata]
+    manifest.remove_exif(link)
+    assert manifest.get_exif(fn.resolve(), fn.stat()) is None
+
+
+def test_parse_date_range() -> None:
+    """Date ranges are converted to bounds that can be compared with dates as strings."""
+    assert parse_date_range("2019-01..2019-06") == ("201901", "201907")
+    assert parse_date_range("2019-12") == ("201912", "202001")
+    assert parse_date_range("2019-02-28..") == ("20190228", "9")
+    assert parse_date_range("..2019") == ("", "2020")
+    assert "201906" <= "20190630_235959" < parse_date_range("2019-06-30")[1]
+    with pytest.raises(ValueError):
+        parse_date_range("2019/01..2019/06")
+
+
+def test_copy_file(tmp_path: Path) -> None:
+    """Files are copied with any available method, and existing targets are kept."""
+    source = tmp_path / "source.jpg"
+    source.write_bytes(os.urandom(3 * 1024 * 1024 + 7))
+    signature = calculate_file_hash(source)
+    result = copy_file(source, tmp_path / "copy.jpg", verify=True)
+    assert result.method in ("reflink", "copy_file_range", "sendfile", "copy_buffer")
+    assert result.signature == calculate_file_hash(tmp_path / "copy.jpg") == signature
+    #
+    target = tmp_path / "target.jpg"
+    result = copy_file(source, target, hash_content=True)
+    if result.method != "reflink":
+        assert result.signature == signature
+    assert result.source_stat is not None and result.source_stat.st_ino == source.stat().st_ino
+    assert target.stat().st_mtime_ns == source.stat().st_mtime_ns
+    #
+    target.write_bytes(b"existing")
+    with pytest.raises(FileExistsError):
+        copy_file(source, target)
+    assert target.read_bytes() == b"existing"
+    #
+    # short copies are not accepted
+    if hasattr(os, "copy_file_range"):
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(os, "copy_file_range", lambda *args: 0)
+            result = copy_file(source, tmp_path / "short.jpg")
+        assert result.method != "copy_file_range"
+        assert calculate_file_hash(tmp_path / "short.jpg") == signature
+    #
+    assert move_file(source, tmp_path / "moved.jpg") == "rename"
+    assert not source.exists()
+    assert calculate_file_hash(tmp_path / "moved.jpg") == signature
+
+
+def test_move_file_across_file_systems(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Sources are not removed if they are not copied in full."""
+    source = tmp_path / "source.jpg"
+    source.write_bytes(b"content")
+
+    def rename(src: Path, dst: Path) -> None:
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    def truncated_copy(src: Path, dst: Path, **kwargs: Any) -> CopyResult:
+        dst.write_bytes(b"cont")
+        return CopyResult("copy_buffer", None, None)
+
+    monkeypatch.setattr(os, "rename", rename)
+    monkeypatch.setattr(utils, "copy_file", truncated_copy)
+    with pytest.raises(OSError, match="differs"):
+        move_file(source, tmp_path / "moved.jpg")
+    assert source.read_bytes() == b"content"
+    assert not (tmp_path / "moved.jpg").exists()